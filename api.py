@@ -0,0 +1,131 @@
+# module for downloading the API feeds - all of them at once, over one pooled session, with timeouts and retries
+#
+# the feeds are asked for conditionally (ETag/Last-Modified of the snapshot), a feed that did not change is not downloaded again,
+# the JSON arrays are decoded record by record while they are downloaded, the whole body is never held in memory
+
+import os, re, json, time, codecs, logging, functools, threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+log = logging.getLogger(__name__)
+
+# seconds to wait for the connection and between the bytes of the response (not for the whole download)
+TIMEOUT = float(os.environ.get("COVID_FETCH_TIMEOUT", 10))
+
+# attempts after the first one failed, waiting BACKOFF, 2 * BACKOFF, 4 * BACKOFF ... seconds in between
+RETRIES = int(os.environ.get("COVID_FETCH_RETRIES", 3))
+BACKOFF = float(os.environ.get("COVID_FETCH_BACKOFF", 0.5))
+
+# server errors (and rate limiting) can go away, the other HTTP errors will not
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# feeds downloaded at the same time (and connections kept per host)
+MAX_WORKERS = 4
+
+# bytes of the response decoded at once
+CHUNK_SIZE = 64 * 1024
+
+_lock = threading.Lock()
+_session = None
+
+
+def session() -> requests.Session:
+    """ Return the session of this process, its pooled connections must not be shared with the forked workers. """
+    global _session
+    with _lock:
+        if _session is None or _session[0] != os.getpid():
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=MAX_WORKERS)
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            _session = (os.getpid(), s)
+        return _session[1]
+
+
+def _retryable(error: Exception) -> bool:
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code in RETRY_STATUS
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError))
+
+
+_json = json.JSONDecoder()
+_SEPARATORS = re.compile(r"[\s,]*")
+
+
+def iter_records(chunks):
+    """ Decode the JSON array from the chunks of bytes, yield its items one by one as soon as they are complete. """
+    text = codecs.getincrementaldecoder("utf-8")()
+    buffer, started = "", False
+    for chunk in chunks:
+        buffer += text.decode(chunk)
+        pos = 0
+        if not started:
+            stripped = buffer.lstrip()
+            if not stripped:
+                continue
+            if stripped[0] != "[":
+                raise ValueError("JSON array expected")
+            buffer, started = stripped[1:], True
+        while True:
+            pos = _SEPARATORS.match(buffer, pos).end()
+            if pos == len(buffer) or buffer[pos] == "]":
+                break
+            try:
+                item, end = _json.raw_decode(buffer, pos)
+            except ValueError:
+                # the item is not complete yet, wait for the next chunk
+                break
+            if end == len(buffer) and not isinstance(item, (dict, list)):
+                # a number can go on in the next chunk
+                break
+            pos = end
+            yield item
+        buffer = buffer[pos:]
+    if not started or buffer.strip() != "]":
+        raise ValueError("JSON array is truncated or malformed")
+
+
+def fetch(url: str, etag: str = None, last_modified: str = None, decode=list):
+    """ Download the JSON feed and decode it, retry timeouts, connection and server errors with exponential backoff.
+    decode gets the iterator of the streamed records (the default keeps them as list of dicts).
+    Return (decoded, validators): decoded is None if the feed did not change since etag/last_modified,
+    validators are {'etag', 'last_modified'} of the response for the next conditional request. """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    for attempt in range(RETRIES + 1):
+        try:
+            with session().get(url, headers=headers, timeout=TIMEOUT, stream=True) as response:
+                if response.status_code == 304:
+                    return None, {"etag": etag, "last_modified": last_modified}
+                response.raise_for_status()
+                # a download broken halfway is retried from the start, decode builds its result again
+                decoded = decode(iter_records(response.iter_content(CHUNK_SIZE)))
+                return decoded, {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+        except requests.RequestException as e:
+            if attempt == RETRIES or not _retryable(e):
+                raise
+            log.warning("Fetching %s failed (%s), retrying in %.1f s.", url, e, BACKOFF * 2 ** attempt)
+        time.sleep(BACKOFF * 2 ** attempt)
+
+
+def fetch_all(urls: list, validators: dict = None, decode=None) -> dict:
+    """ Fetch the feeds in parallel, conditionally if validators {url: {'etag', 'last_modified'}} are given,
+    decode(url, records) turns the streamed records of each one into the result (list of dicts by default).
+    Return {url: (decoded, validators)}, or {url: exception} for the feeds that could not be fetched. """
+    validators = validators or {}
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {url: executor.submit(fetch, url, decode=functools.partial(decode, url) if decode else list,
+                                        **validators.get(url, {}))
+                   for url in urls}
+    results = {}
+    for url, future in futures.items():
+        try:
+            results[url] = future.result()
+        except Exception as e:
+            results[url] = e
+    return results
@@ -1,13 +1,16 @@
 import os
+import gc
 import datetime
 import pandas as pd
+import flask
+from flask_compress import Compress
 
 # plotly imports
 import plotly.express as px
 import plotly.graph_objs as go
 
 # dash imports
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State, ClientsideFunction
 from dash.exceptions import PreventUpdate
 import dash
 import dash_table
@@ -16,168 +19,129 @@ import dash_html_components as html
 import dash_bootstrap_components as dbc
 
 # custom imports
-from utils import rename_datatable_columns, get_api_data, create_df_for_date
-from charts import hosp_death_daily_increase, create_mortality_barchart, cumulative_linechart_us, total_tests_pie, hospitalized, cumulative_barchart_us, scatter_bar_population_positive
-
-# get the global API data
-daily_states_df = get_api_data( "https://covidtracking.com/api/v1/states/daily.json")
-daily_us_df = get_api_data("https://covidtracking.com/api/v1/us/daily.json")
-current_state_df = get_api_data("https://covidtracking.com/api/v1/states/current.json")
-current_us_df = get_api_data( "https://covidtracking.com/api/v1/us/current.json")
-
-# static data about state population - scrapped from wikipedia
-pop_df = pd.read_json(os.path.join(
-    os.path.dirname(__file__), "data", "us-pop.json"))
-
-
-# merged df used for for all callback charts
-df = pd.merge(daily_states_df, pop_df, on="state")
+import datastore
+from cache import create_cache, memoize
+from utils import rename_datatable_columns, create_df_for_date, index_by_date, states_for_date, TABLE_COLUMNS
+from table_query import query_table
+import static_figures
+import figures
+import sunburst
+import telemetry
+from charts import positive_map_animation, regions_sunburst_animation
+
+# the global API data and state population - loaded once per process in the data store
+daily_states_df = datastore.daily_states_df
+daily_us_df = datastore.daily_us_df
+current_state_df = datastore.current_state_df
+current_us_df = datastore.current_us_df
+pop_df = datastore.pop_df
+
+
+# merged df used for for all callback charts, sorted by date with index {date: slice of rows}
+df, df_by_date = index_by_date(pd.merge(daily_states_df, pop_df, on="state"))
 # pd.set_option("display.max_columns", None)
 
+# serialized callback charts, the data are frozen so the same dates are asked for over and over,
+# with COVID_CACHE_BACKEND=sqlite/redis one worker's charts serve all the others
+figure_cache = create_cache()
 
-external_stylesheets = [
-    "https://codepen.io/chriddyp/pen/bWLwgP.css", dbc.themes.BOOTSTRAP]
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
-server = app.server
-app.title = "COVID-19 TRACKER"
-
-app.layout = html.Div([
-    html.H1(children='COVID-19 DATA TRACKER - THE FIRST YEAR OF PANDEMY OUTBURST IN USA',
-            style={"margin": "50px auto 0 auto", "margin-bottom": "50px"}),
-
-    # -------------------------- FIRST SECTION: NUMBERS OF 4 CASES -------------------------------------
-
-    html.Div([
-        html.Div([
-            dbc.Jumbotron([
-                html.H3(f"{daily_us_df['positive'][0]:,}",
-                        className="display-3"),
-                html.P(
-                    "Positive cases",
-                    className="lead",
-                ),
-            ], style={"text-align": "center", "padding": "10px"})
-        ], className="three columns"),
-
-        html.Div([
-            dbc.Jumbotron([
-                html.H3(
-                    f"{int(daily_us_df['hospitalizedCumulative'][0]):,}", className="display-3"),
-                html.P(
-                    "Hospitalized cases",
-                    className="lead",
-                ),
-            ], style={"text-align": "center", "padding": "10px"})
-        ], className="three columns"),
-
-        html.Div([
-            dbc.Jumbotron([
-                html.H3(
-                    f"{int(daily_us_df['pending'].fillna(0)[0]):,}", className="display-3"),
-                html.P(
-                    "Pending cases",
-                    className="lead",
-                ),
-            ], style={"text-align": "center", "padding": "10px"})
-        ], className="three columns"),
-
-        html.Div([
-            dbc.Jumbotron([
-                html.H3(
-                    f"{int(daily_us_df['death'][0]):,}", className="display-3"),
-                html.P(
-                    "Fatal cases",
-                    className="lead",
-                ),
-
-            ], style={"text-align": "center", "padding": "10px"})
-        ], className="three columns"),
-
-    ], style={"width": "90%", "margin": "auto"}),
-
-    # -------------------------- SECOND PART: 5 CHARTS, 2 ABOVE, 3 BELOW [NUMBERS OF WHOLE USA] -------------------------------------
-
-    dbc.Jumbotron(
-        [
-            html.Div([
-                html.H2("Global Overview: USA Reported Cases"),
-                html.P("These charts show the reported numbers for the whole USA from the inception date.", style={
-                       'text-align': 'center', "font-size": "12px"}),
-                html.P("They are collected daily and updated regularly each day at 20:00 CT. All the charts are interactive, you can hover over it to see the details or/and filter out a trace by clicking on its legend.",
-                       style={'text-align': 'center', "font-size": "12px", "margin-bottom": "20px"}),
-            ], className="twelve columns", style={'text-align': 'center'}),
-
-            html.Div([
-                dbc.Jumbotron([  # linechart: Cummulative progresion in time
-                    dcc.Graph(figure=cumulative_linechart_us()),
-                ], className="seven columns", style={"padding": "0px"}),
-
-                dbc.Jumbotron([  # barchart: Absolute numbers
-                    dcc.Graph(figure=cumulative_barchart_us()),
-                ], className="five columns", style={"padding": "0px"}),
-            ]),
-
-            html.Div([
-                dbc.Jumbotron([  # pie chart: Total tests
-                    dcc.Graph(figure=total_tests_pie())
-                ], className="three columns", style={"padding": "0px"}),
+# data the cached callback outputs are built from - the data store swaps its frames before the derived ones
+# (df, metrics, sunburst cube, table frames) are rebuilt, reload_data moves it on only once they are
+cache_version = datastore.data_version()
 
-                dbc.Jumbotron([  # line chart: Daily increase
-                    dcc.Graph(figure=hosp_death_daily_increase())
-                ], className="six columns", style={"padding": "0px"}),
 
-                dbc.Jumbotron([  # bar chart: Hospitalization
-                    dcc.Graph(figure=hospitalized())
-                ], className="three columns", style={"padding": "0px"}),
-            ]),
-        ], className="twelve columns"),
+def cached_version() -> str:
+    """ Return the version the callback outputs are cached under: the data and the render version of the code building them,
+    the shared caches outlive deploys. """
+    return f"{cache_version}-{static_figures.RENDER_VERSION}"
 
-    # -------------------------- THIRD PART: 4 CHARTS + DATE-PICKER CALLBACK [NUMBERS FOR STATES] -------------------------------------
 
-    dbc.Jumbotron([
-        html.Div([
-            html.H3("Daily Tracker of Reported Cases by State", style={"text-align": "center"}),
-            html.P("These four plots show the progression of COVID-19 by the state on a daily basis.", style={"font-size": "13px"}),
-            html.P("The choropleth displays the density of reported cases, the pie shows a simple distribution across all the states, and the correlation plots the dependency between positive cases and the population of the particular state. The sunburst chart down left sums up all the reported cases by regions, divisions, and states, weights it out by the number of deaths, and colors the region based on that result. You can hover over a region to see the details or click to expand it", style={"font-size": "12px"}),
-            html.P("Pick up a date to see the progression in a particular point in time."),
-            html.Div([
-                dcc.DatePickerSingle(
-                    id='my-date-picker-single',
-                    min_date_allowed=datetime.date(2020, 1, 22),
-                    max_date_allowed=datetime.date(2021, 3, 7),
-                    date=str(datetime.date(2021, 3, 7))
-                ),
-            ], style={"font-size": "14px"}),
+# DataTable rows are filtered, sorted and paged on the server with COVID_TABLE_MODE=custom (default 'native' - in the browser)
+TABLE_MODE = os.environ.get("COVID_TABLE_MODE", "native")
+table_cache = create_cache()
+telemetry.register_cache("figure", figure_cache)
+telemetry.register_cache("table", table_cache)
 
-            html.Br(),
-        ], style={'text-align': 'center', "margin-bottom": "30px"}, className="twelve columns"),
+# the table barchart is built in the browser from the table rows, unless COVID_CLIENTSIDE_CHART=0,
+# in custom mode the table holds only one page, so the chart is built on the server
+CLIENTSIDE_BAR_CHART = TABLE_MODE == "native" and os.environ.get("COVID_CLIENTSIDE_CHART", "1") not in ("", "0")
 
-        html.Div([
-            dbc.Jumbotron([  # left up chart: Map
-                dcc.Graph(id='usa_map')
-                ], className="seven columns", style={"padding": "0px"}),
+# table data by source, rebuilt after data refresh
+_table_frames = {}
 
-            dbc.Jumbotron([  # right up chart: Pie
-                dcc.Graph(id='us_pie')
-                ], className="five columns", style={"padding": "0px"}),
-        ]),
 
-        html.Div([
-            dbc.Jumbotron([  # left down chart: Regions and divisions
-                dcc.Graph(id="us_sunburst")
-                ], className="seven columns", style={"padding": "0px"}),
+def table_frame(source: str = "current") -> pd.DataFrame:
+    """ Return the table data, 'current' numbers of the states or their whole daily 'history', with row ids for the selection. """
+    frame = _table_frames.get(source)
+    if frame is None:
+        if source == "history":
+            frame = daily_states_df[["state", "date"] + TABLE_COLUMNS[1:]]
+            frame = frame.assign(id=frame["state"].astype(str) + ":" + frame["date"].astype(str))
+        else:
+            frame = current_state_df[TABLE_COLUMNS]
+            frame = frame.assign(id=frame["state"])
+        _table_frames[source] = frame
+    return frame
 
-            dbc.Jumbotron([  # right down chart: Scatter corelation
-                dcc.Graph(id="us_corel")
-                ], className="five columns", style={"padding": "0px"}),
-        ]),
 
-        ], className="twelve columns"),
+def latest_date() -> datetime.date:
+    """ Return the latest day in the data (the API is frozen at 2021-03-07, but it moves with the refresher). """
+    return datetime.datetime.strptime(str(daily_us_df["date"].max()), "%Y%m%d").date()
 
 
-    # -------------------------- FOURTH PART: 2 WIDE BARCHARTS [NUMBERS FOR STATES] -------------------------------------
+external_stylesheets = [
+    "https://codepen.io/chriddyp/pen/bWLwgP.css", dbc.themes.BOOTSTRAP]
+app = dash.Dash(__name__, external_stylesheets=external_stylesheets, compress=False)
+server = app.server
+app.title = "COVID-19 TRACKER"
 
-    dbc.Jumbotron(
+# responses are compressed with brotli if the browser takes it, else gzip (Dash would register gzip only)
+server.config["COMPRESS_ALGORITHM"] = os.environ.get("COVID_COMPRESS_ALGORITHM", "br,gzip").split(",")
+Compress(server)
+
+# how long (in seconds) a reverse proxy caching POST responses can reuse the callback responses (they depend only
+# on the request and the data), 0 (default) sends no Cache-Control with them - browsers do not cache POST anyway
+HTTP_MAX_AGE = int(os.environ.get("COVID_HTTP_MAX_AGE", 0))
+
+
+@server.after_request
+def add_cache_headers(response):
+    """ Add ETag (hash of the body) to the layout and the callback dependencies, they are revalidated on every load (304 if unchanged).
+    Runs before the compression, which suffixes the ETag with the encoding. The callback responses are POST, never asked for
+    conditionally, they get only Cache-Control with HTTP_MAX_AGE (if set). """
+    if response.status_code != 200:
+        return response
+    if flask.request.path.endswith("_dash-update-component"):
+        if HTTP_MAX_AGE:
+            response.headers["Cache-Control"] = f"public, max-age={HTTP_MAX_AGE}"
+        return response
+    if flask.request.method != "GET" or not flask.request.path.endswith(("_dash-layout", "_dash-dependencies")):
+        return response
+    response.add_etag()
+    # the browser sends back the ETag of the encoding it got, e.g. "<hash>:br" - the same body (werkzeug drops it from the 304)
+    etag = response.get_etag()[0]
+    matched = [tag for tag in flask.request.if_none_match.as_set() if tag.split(":")[0] == etag]
+    if matched:
+        response.set_etag(matched[0])
+        response.status_code = 304
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+# callback/stage timers, payload sizes and cache hit ratios on /metrics (and the profiler, see telemetry.py)
+telemetry.install(app)
+
+# with COVID_LAZY_LAYOUT=1 the sections below the fold are sent only when they scroll into view,
+# their components (and callbacks) are not in the initial layout then
+LAZY_LAYOUT = os.environ.get("COVID_LAZY_LAYOUT", "") not in ("", "0")
+app.config.suppress_callback_exceptions = LAZY_LAYOUT
+
+# keep the data current in long-running workers (the thread is started in each worker, after the fork)
+server.before_first_request(datastore.start_refresher)
+
+
+def state_barcharts_section():
+    """ Create the fourth part: 2 wide barcharts [numbers for states]. """
+    return dbc.Jumbotron(
         [
             html.Div([
                 html.H3("Reported Cases by State",
@@ -189,18 +153,19 @@ app.layout = html.Div([
             ], style={'text-align': 'center', "margin-bottom": "30px"}, className="twelve columns"),
 
             dbc.Jumbotron([  # first barchart: Population and positive cases
-                dcc.Graph(figure=scatter_bar_population_positive())
+                dcc.Graph(figure=static_figures.load("scatter_bar_population_positive"))
             ], className="twelve columns", style={"padding": "0px"}),
 
             dbc.Jumbotron([  # second barchart: Mortality
-                dcc.Graph(figure=create_mortality_barchart())
+                dcc.Graph(figure=static_figures.load("create_mortality_barchart"))
             ], className="twelve columns", style={"padding": "0px"}),
 
-        ], className="twelve columns"),
+        ], className="twelve columns")
 
-    # -------------------------- FIFTH PART: TABLE WITH BARCHART + CALLBACK [NUMBERS FOR STATES] -------------------------------------
 
-    dbc.Jumbotron([
+def table_section():
+    """ Create the fifth part: table with barchart + callback [numbers for states]. """
+    return dbc.Jumbotron([
         html.Div([  # the interactive table
             html.H3("Reported Cases: Tabular Data Overwiev",
                     style={"text-align": "center"}),
@@ -208,18 +173,31 @@ app.layout = html.Div([
             html.P("This interactive table allows you to filter out data using arithmetic operators. If you for example want to see only states with positive cases above 1000, just type '> 1000' in the column 'Positive'. You can also use the checkboxes on the left to plot the data for a particular state in the bar chart on the right-hand side of the table.",
                    style={"text-align": "center", "font-size": "12px"}),
             html.Br(),
+            dcc.RadioItems(id='table-source',
+                           options=[
+                               {'label': 'Current', 'value': 'current'},
+                               {'label': 'Daily history', 'value': 'history'},
+                           ],
+                           value='current',
+                           labelStyle={'display': 'inline-block', 'margin': '0 10px'},
+                           style={} if TABLE_MODE == "custom" else {'display': 'none'}),
             dash_table.DataTable(
                 id='datatable_id',
-                data=current_state_df.to_dict('records'),
+                # in custom mode the rows come page by page from the update_table callback
+                data=[] if TABLE_MODE == "custom" else table_frame().to_dict('records'),
                 columns=rename_datatable_columns(),  # here i use the renamed headers
                 editable=False,
-                filter_action="native",
-                sort_action="native",
+                filter_action=TABLE_MODE,
+                filter_query='',
+                sort_action=TABLE_MODE,
                 sort_mode="multi",
+                sort_by=[],
                 row_selectable="multi",
                 row_deletable=False,
                 selected_rows=[],
-                page_action='native',
+                selected_row_ids=[],
+                page_action=TABLE_MODE,
+                page_current=0,
                 page_size=11,
                 fixed_rows={'headers': True, 'data': 0},
                 virtualization=False,
@@ -249,19 +227,329 @@ app.layout = html.Div([
                          ),
             html.Br(),
             dcc.Graph(id='horizontal_barchart', style={"padding": "0px"}),
+            dcc.Store(id='barchart-config', data=bar_chart_config() if CLIENTSIDE_BAR_CHART else None),
         ], className="four columns"),
 
-    ], className="twelve columns"),
+    ], className="twelve columns")
+
 
-    html.Footer([
-        html.P("Primary data source: CovidTracking API. Created by Lukash K. © 2020.", style={
-               "text-align": "center"}),
-        html.P(html.A('Buy me a drink and support this project.',
-                      href='https://www.buymeacoffee.com/nirvikalpa'), style={"text-align": "center"}),
-    ], style={"margin": "1px auto 0 auto"})
+def lazy_section(section_id: str):
+    """ Create placeholder of the section, it is filled by its callback when its "Loading..." trigger is clicked
+    (assets/lazy.js clicks it when it scrolls into view). The section replaces the trigger, so the clicks inside
+    the loaded section do not load it again. """
+    return html.Div(html.P("Loading...", id=f"{section_id}-trigger", className="lazy-section", n_clicks=None,
+                           style={"text-align": "center", "padding": "50px"}),
+                    id=section_id, className="twelve columns")
 
-], className="row", style={"width": "80%", "margin": "auto"}
-)
+
+def create_layout():
+    """ Create the whole page, the static charts are built from the data held at the moment. """
+    last_date = latest_date()
+    return html.Div([
+        html.H1(children='COVID-19 DATA TRACKER - THE FIRST YEAR OF PANDEMY OUTBURST IN USA',
+                style={"margin": "50px auto 0 auto", "margin-bottom": "50px"}),
+
+        # -------------------------- FIRST SECTION: NUMBERS OF 4 CASES -------------------------------------
+
+        html.Div([
+            html.Div([
+                dbc.Jumbotron([
+                    html.H3(f"{int(daily_us_df['positive'].iloc[0]):,}",
+                            className="display-3"),
+                    html.P(
+                        "Positive cases",
+                        className="lead",
+                    ),
+                ], style={"text-align": "center", "padding": "10px"})
+            ], className="three columns"),
+
+            html.Div([
+                dbc.Jumbotron([
+                    html.H3(
+                        f"{int(daily_us_df['hospitalizedCumulative'].iloc[0]):,}", className="display-3"),
+                    html.P(
+                        "Hospitalized cases",
+                        className="lead",
+                    ),
+                ], style={"text-align": "center", "padding": "10px"})
+            ], className="three columns"),
+
+            html.Div([
+                dbc.Jumbotron([
+                    html.H3(
+                        f"{int(daily_us_df['pending'].fillna(0).iloc[0]):,}", className="display-3"),
+                    html.P(
+                        "Pending cases",
+                        className="lead",
+                    ),
+                ], style={"text-align": "center", "padding": "10px"})
+            ], className="three columns"),
+
+            html.Div([
+                dbc.Jumbotron([
+                    html.H3(
+                        f"{int(daily_us_df['death'].iloc[0]):,}", className="display-3"),
+                    html.P(
+                        "Fatal cases",
+                        className="lead",
+                    ),
+
+                ], style={"text-align": "center", "padding": "10px"})
+            ], className="three columns"),
+
+        ], style={"width": "90%", "margin": "auto"}),
+
+        # -------------------------- SECOND PART: 5 CHARTS, 2 ABOVE, 3 BELOW [NUMBERS OF WHOLE USA] -------------------------------------
+
+        dbc.Jumbotron(
+            [
+                html.Div([
+                    html.H2("Global Overview: USA Reported Cases"),
+                    html.P("These charts show the reported numbers for the whole USA from the inception date.", style={
+                           'text-align': 'center', "font-size": "12px"}),
+                    html.P("They are collected daily and updated regularly each day at 20:00 CT. All the charts are interactive, you can hover over it to see the details or/and filter out a trace by clicking on its legend.",
+                           style={'text-align': 'center', "font-size": "12px", "margin-bottom": "20px"}),
+                ], className="twelve columns", style={'text-align': 'center'}),
+
+                html.Div([
+                    dbc.Jumbotron([  # linechart: Cummulative progresion in time
+                        dcc.Graph(figure=static_figures.load("cumulative_linechart_us")),
+                    ], className="seven columns", style={"padding": "0px"}),
+
+                    dbc.Jumbotron([  # barchart: Absolute numbers
+                        dcc.Graph(figure=static_figures.load("cumulative_barchart_us")),
+                    ], className="five columns", style={"padding": "0px"}),
+                ]),
+
+                html.Div([
+                    dbc.Jumbotron([  # pie chart: Total tests
+                        dcc.Graph(figure=static_figures.load("total_tests_pie"))
+                    ], className="three columns", style={"padding": "0px"}),
+
+                    dbc.Jumbotron([  # line chart: Daily increase
+                        dcc.Graph(figure=static_figures.load("hosp_death_daily_increase"))
+                    ], className="six columns", style={"padding": "0px"}),
+
+                    dbc.Jumbotron([  # bar chart: Hospitalization
+                        dcc.Graph(figure=static_figures.load("hospitalized"))
+                    ], className="three columns", style={"padding": "0px"}),
+                ]),
+            ], className="twelve columns"),
+
+        # -------------------------- THIRD PART: 4 CHARTS + DATE-PICKER CALLBACK [NUMBERS FOR STATES] -------------------------------------
+
+        dbc.Jumbotron([
+            html.Div([
+                html.H3("Daily Tracker of Reported Cases by State", style={"text-align": "center"}),
+                html.P("These four plots show the progression of COVID-19 by the state on a daily basis.", style={"font-size": "13px"}),
+                html.P("The choropleth displays the density of reported cases, the pie shows a simple distribution across all the states, and the correlation plots the dependency between positive cases and the population of the particular state. The sunburst chart down left sums up all the reported cases by regions, divisions, and states, weights it out by the number of deaths, and colors the region based on that result. You can hover over a region to see the details or click to expand it", style={"font-size": "12px"}),
+                html.P("Pick up a date to see the progression in a particular point in time."),
+                html.Div([
+                    dcc.DatePickerSingle(
+                        id='my-date-picker-single',
+                        min_date_allowed=datetime.date(2020, 1, 22),
+                        max_date_allowed=last_date,
+                        date=str(last_date)
+                    ),
+                ], style={"font-size": "14px"}),
+
+                html.Br(),
+            ], style={'text-align': 'center', "margin-bottom": "30px"}, className="twelve columns"),
+
+            html.Div([
+                dbc.Jumbotron([  # left up chart: Map
+                    dcc.Graph(id='usa_map')
+                    ], className="seven columns", style={"padding": "0px"}),
+
+                dbc.Jumbotron([  # right up chart: Pie
+                    dcc.Graph(id='us_pie')
+                    ], className="five columns", style={"padding": "0px"}),
+            ]),
+
+            html.Div([
+                dbc.Jumbotron([  # left down chart: Regions and divisions
+                    dcc.Graph(id="us_sunburst")
+                    ], className="seven columns", style={"padding": "0px"}),
+
+                dbc.Jumbotron([  # right down chart: Scatter corelation
+                    dcc.Graph(id="us_corel")
+                    ], className="five columns", style={"padding": "0px"}),
+            ]),
+
+            html.Div([
+                html.P("Pick up a date range and press Play to see how the reported cases spread over the states and regions."),
+                html.Div([
+                    dcc.DatePickerRange(
+                        id='animation-date-range',
+                        min_date_allowed=datetime.date(2020, 1, 22),
+                        max_date_allowed=last_date,
+                        start_date=str(last_date - datetime.timedelta(days=60)),
+                        end_date=str(last_date)
+                    ),
+                ], style={"font-size": "14px"}),
+            ], style={'text-align': 'center', "margin-top": "30px"}, className="twelve columns"),
+
+            html.Div([
+                dbc.Jumbotron([  # animated map of the date range, the days are played in the browser
+                    dcc.Graph(id="usa_map_animation")
+                    ], className="twelve columns", style={"padding": "0px"}),
+            ]),
+
+            html.Div([
+                dbc.Jumbotron([  # animated sunburst of the same date range
+                    dcc.Graph(id="us_sunburst_animation")
+                    ], className="twelve columns", style={"padding": "0px"}),
+            ]),
+
+            ], className="twelve columns"),
+
+
+        # -------------------------- FOURTH PART: 2 WIDE BARCHARTS [NUMBERS FOR STATES] -------------------------------------
+
+        lazy_section("lazy-state-barcharts") if LAZY_LAYOUT else state_barcharts_section(),
+
+        # -------------------------- FIFTH PART: TABLE WITH BARCHART + CALLBACK [NUMBERS FOR STATES] -------------------------------------
+
+        lazy_section("lazy-table") if LAZY_LAYOUT else table_section(),
+
+        html.Footer([
+            html.P("Primary data source: CovidTracking API. Created by Lukash K. © 2020.", style={
+                   "text-align": "center"}),
+            html.P(html.A('Buy me a drink and support this project.',
+                          href='https://www.buymeacoffee.com/nirvikalpa'), style={"text-align": "center"}),
+        ], style={"margin": "1px auto 0 auto"})
+
+    ], className="row", style={"width": "80%", "margin": "auto"}
+    )
+
+
+if LAZY_LAYOUT:
+    @app.callback(
+        Output('lazy-state-barcharts', 'children'),
+        [Input('lazy-state-barcharts-trigger', 'n_clicks')])
+    @telemetry.timed("load_state_barcharts")
+    def load_state_barcharts(n_clicks):
+        """ Fill the lazy placeholder with the state barcharts. """
+        if n_clicks is None:
+            raise PreventUpdate
+        return state_barcharts_section()
+
+    @app.callback(
+        Output('lazy-table', 'children'),
+        [Input('lazy-table-trigger', 'n_clicks')])
+    @telemetry.timed("load_table")
+    def load_table(n_clicks):
+        """ Fill the lazy placeholder with the table and its barchart. """
+        if n_clicks is None:
+            raise PreventUpdate
+        return table_section()
+
+
+@datastore.on_refresh
+def reload_data():
+    """ Pick up the refreshed data from the data store and rebuild everything derived from it. """
+    global daily_states_df, daily_us_df, current_state_df, current_us_df, df, df_by_date, cache_version
+    daily_states_df = datastore.daily_states_df
+    daily_us_df = datastore.daily_us_df
+    current_state_df = datastore.current_state_df
+    current_us_df = datastore.current_us_df
+    df, df_by_date = index_by_date(pd.merge(daily_states_df, pop_df, on="state"))
+    app.layout = create_layout()
+    _table_frames.clear()
+    # the listeners of utils, metrics and sunburst were registered (and so ran) before this one
+    cache_version = datastore.data_version()
+    figure_cache.clear()
+    table_cache.clear()
+    warm_figure_cache()
+
+
+def build_date_figures(date: str):
+    """ Build Map, Pie, Scatter and Sunburst charts for date from the date-picker (as 'YYYY-MM-DD'). """
+    date = date.replace("-", "")
+    qdf = df.iloc[df_by_date.get(int(date), slice(0, 0))]
+
+    # building the Map
+    fig_map = go.Figure(data=go.Choropleth(locations=qdf["state"],
+                                           z=qdf["positive"].astype(int),
+                                           autocolorscale=True,
+                                           colorscale='Bluered',
+                                           colorbar_title="Positive",
+                                           locationmode='USA-states'))
+    fig_map.update_layout(title_text='Density by State',
+                          height=600,
+                          geo=dict(scope='usa',
+                                   projection=go.layout.geo.Projection(
+                                       type='albers usa'),
+                                   lakecolor='rgb(255, 255, 255)'
+                                   ),
+                          margin=dict(l=1,
+                                      r=1,
+                                      ),
+                          )
+    # building the Pie
+    fig_pie = px.pie(qdf,
+                     values='positive',
+                     names='state',
+                     title='Distribution by State')
+    fig_pie.update_layout(height=600,
+                          legend=dict(x=1,
+                                      y=1,
+                                      ),
+                          )
+    # this will show only text that fits into the piesegmet
+    fig_pie.update_traces(textposition='inside')
+    fig_pie.update_layout(uniformtext_minsize=9, uniformtext_mode='hide')
+    # positiong of the chart itself, without the title
+    fig_pie.update_traces(domain_x=[0, 0.9])
+
+    # building the Corelation scatter
+    fig_scatter = go.Figure(data=go.Scatter(x=qdf["pop"].fillna(0),
+                                            y=qdf["positive"].fillna(0),
+                                            mode='markers',
+                                            text=qdf['state name']))
+    fig_scatter.update_layout(plot_bgcolor='rgba(0,0,0,0)',
+                              title='Correlation of Reported Cases & Population',
+                              autosize=True,
+                              height=600,
+                              margin=dict(l=10,
+                                          r=10
+                                          ),
+                              )
+
+    # building the Sunburst
+    # print(date)
+    date_df = create_df_for_date(int(date))
+    # print(date_df)
+    fig_sunburst = px.sunburst(date_df,
+                               path=["total positive", "region",
+                                     "division", "state"],
+                               values='positive',
+                               color="death",
+                               color_continuous_scale="Rdbu")
+    fig_sunburst.update_layout(height=600,
+                               title="Positive Cases by Region - Click To Expand",
+                               margin=dict(l=1,
+                                           r=1,
+                                           b=70,
+                                           t=100,
+                                           )
+                               )
+
+    return (fig_map, fig_pie, fig_scatter, fig_sunburst)
+
+
+def fast_date_figures(date: str):
+    """ Build the same charts as build_date_figures, as plain dicts without plotly validation (see figures.py). """
+    date = date.replace("-", "")
+    with telemetry.stage("data"):
+        qdf = df.iloc[df_by_date.get(int(date), slice(0, 0))]
+        tree = sunburst.for_date(int(date))
+    with telemetry.stage("figure"):
+        return (figures.choropleth_map(qdf), figures.states_pie(qdf), figures.corel_scatter(qdf), figures.regions_sunburst(tree))
+
+
+# the four date-picker charts as JSON-like dicts, built only if they are not in the figure cache
+cached_date_figures = memoize(figure_cache, cached_version)(figures.compacted(fast_date_figures))
 
 
 @app.callback(
@@ -270,110 +558,68 @@ app.layout = html.Div([
      Output(component_id='us_corel', component_property='figure'),
      Output(component_id='us_sunburst', component_property='figure')],
     [Input(component_id='my-date-picker-single', component_property='date')],)
+@telemetry.timed("update_output")
 def update_output(date):
     """ Update Map, Pie, Sunburst and Scatter charts through the date-picker callback button. """
     if date is None:
         print("in none")
         raise PreventUpdate
-    else:
-        date = date.replace("-", "")
-        qdf = df.query("date=={}".format(date))
-
-        # building the Map
-        fig_map = go.Figure(data=go.Choropleth(locations=qdf["state"],
-                                               z=qdf["positive"].astype(int),
-                                               autocolorscale=True,
-                                               colorscale='Bluered',
-                                               colorbar_title="Positive",
-                                               locationmode='USA-states'))
-        fig_map.update_layout(title_text='Density by State',
-                              height=600,
-                              geo=dict(scope='usa',
-                                       projection=go.layout.geo.Projection(
-                                           type='albers usa'),
-                                       lakecolor='rgb(255, 255, 255)'
-                                       ),
-                              margin=dict(l=1,
-                                          r=1,
-                                          ),
-                              )
-        # building the Pie
-        fig_pie = px.pie(qdf,
-                         values='positive',
-                         names='state',
-                         title='Distribution by State')
-        fig_pie.update_layout(height=600,
-                              legend=dict(x=1,
-                                          y=1,
-                                          ),
-                              )
-        # this will show only text that fits into the piesegmet
-        fig_pie.update_traces(textposition='inside')
-        fig_pie.update_layout(uniformtext_minsize=9, uniformtext_mode='hide')
-        # positiong of the chart itself, without the title
-        fig_pie.update_traces(domain_x=[0, 0.9])
-
-        # building the Corelation scatter
-        fig_scatter = go.Figure(data=go.Scatter(x=qdf["pop"].fillna(0),
-                                                y=qdf["positive"].fillna(0),
-                                                mode='markers',
-                                                text=qdf['state name']))
-        fig_scatter.update_layout(plot_bgcolor='rgba(0,0,0,0)',
-                                  title='Correlation of Reported Cases & Population',
-                                  autosize=True,
-                                  height=600,
-                                  margin=dict(l=10,
-                                              r=10
-                                              ),
-                                  )
-
-        # building the Sunburst
-        # print(date)
-        date_df = create_df_for_date(int(date))
-        # print(date_df)
-        fig_sunburst = px.sunburst(date_df,
-                                   path=["total positive", "region",
-                                         "division", "state"],
-                                   values='positive',
-                                   color="death",
-                                   color_continuous_scale="Rdbu")
-        fig_sunburst.update_layout(height=600,
-                                   title="Positive Cases by Region - Click To Expand",
-                                   margin=dict(l=1,
-                                               r=1,
-                                               b=70,
-                                               t=100,
-                                               )
-                                   )
+    return cached_date_figures(date)
 
-    return (fig_map, fig_pie, fig_scatter, fig_sunburst)
+
+# the animated map and sunburst as JSON-like dicts, all the days of the range are in their frames
+cached_map_animation = memoize(figure_cache, cached_version)(figures.compacted(positive_map_animation))
+cached_sunburst_animation = memoize(figure_cache, cached_version)(figures.compacted(regions_sunburst_animation))
 
 
 @app.callback(
-    Output('horizontal_barchart', 'figure'),
-    [Input('datatable_id', 'selected_rows'),
-     Input('dropval', 'value')])
-def update_data(selected_rows, dropval):
-    """ Update the Horizontal Barchar based on what states are selected in the table and what is picked in dropdown. """
+    [Output(component_id='usa_map_animation', component_property='figure'),
+     Output(component_id='us_sunburst_animation', component_property='figure')],
+    [Input(component_id='animation-date-range', component_property='start_date'),
+     Input(component_id='animation-date-range', component_property='end_date')],)
+@telemetry.timed("update_animation")
+def update_animation(start_date, end_date):
+    """ Update the animated map and sunburst through the date-range picker, playing them does not call the server. """
+    if start_date is None or end_date is None:
+        raise PreventUpdate
+    start, end = int(start_date[:10].replace("-", "")), int(end_date[:10].replace("-", ""))
+    return cached_map_animation(start, end), cached_sunburst_animation(start, end)
+
+
+def warm_figure_cache():
+    """ Render the charts for dates in COVID_PREWARM_DATES (comma separated), by default the date picker default - the most requested one. """
+    for date in os.environ.get("COVID_PREWARM_DATES", str(latest_date())).split(","):
+        if date.strip():
+            cached_date_figures(date.strip())
+
+
+warm_figure_cache()
+
+
+# states charted when none is selected, and the X-axis labels of the dropdown values
+BAR_CHART_DEFAULT_STATES = ["NJ", "IL", "MA", "TX", "PA", "KS", "OH", "UT", "VI", "VT"]
+BAR_CHART_LABELS = {"positive": "Positive", "totalTestResults": "Tested", "hospitalized": "Hospitalized",
+                    "recovered": "Recovered", "death": "Fatal"}
+
+
+def bar_chart_states(selected_states: list) -> pd.DataFrame:
+    """ Return current numbers of the states selected in the table. """
+    # plotly cannot chart no rows, so states not in the current data fall back to the default ones
+    selected_states = [state for state in selected_states if state in set(current_state_df['state'])]
+    if len(selected_states) == 0:
+        return current_state_df[current_state_df['state'].isin(
+            BAR_CHART_DEFAULT_STATES)]
+    return current_state_df[current_state_df['state'].isin(
+        selected_states)]
+
+
+def build_bar_chart(selected_states: list, dropval: str):
+    """ Build the Horizontal Barchart for the states selected in the table and the case picked in dropdown. """
     # update the table
-    if len(selected_rows) == 0:
-        grouped_sel_df = current_state_df[current_state_df['state'].isin(
-            ["NJ", "IL", "MA", "TX", "PA", "KS", "OH", "UT", "VI", "VT"])]
-    else:
-        grouped_sel_df = current_state_df[current_state_df.index.isin(
-            selected_rows)]
+    grouped_sel_df = bar_chart_states(selected_states)
 
     # update the X-axis labels based on the dropdown selection
-    if dropval == "positive":
-        xaxis_label = "Positive"
-    elif dropval == "totalTestResults":
-        xaxis_label = "Tested"
-    elif dropval == "hospitalized":
-        xaxis_label = "Hospitalized"
-    elif dropval == "recovered":
-        xaxis_label = "Recovered"
-    elif dropval == "death":
-        xaxis_label = "Fatal"
+    xaxis_label = BAR_CHART_LABELS[dropval]
 
     # build the Horizontal Barchart
     bar_chart = px.bar(data_frame=grouped_sel_df,
@@ -396,5 +642,95 @@ def update_data(selected_rows, dropval):
     return (bar_chart)
 
 
+def fast_bar_chart(selected_states: list, dropval: str):
+    """ Build the same chart as build_bar_chart, as plain dict without plotly validation (see figures.py). """
+    with telemetry.stage("data"):
+        states_df = bar_chart_states(selected_states)
+    with telemetry.stage("figure"):
+        return figures.states_bar(states_df, dropval, BAR_CHART_LABELS[dropval])
+
+
+# the table barchart as JSON-like dict, built only if it is not in the figure cache
+cached_bar_chart = memoize(figure_cache, cached_version)(figures.compacted(fast_bar_chart))
+
+
+@telemetry.timed("update_data")
+def update_data(selected_row_ids, dropval):
+    """ Update the Horizontal Barchar based on what states are selected in the table and what is picked in dropdown. """
+    # rows are selected by ids (they survive paging), rows of the history are 'state:date' - the chart shows current numbers of their states,
+    # it does not depend on the order the rows were selected in
+    selected_states = sorted({str(row_id).split(":")[0] for row_id in selected_row_ids or []})
+    return cached_bar_chart(selected_states, dropval)
+
+
+def bar_chart_config() -> dict:
+    """ Return what the clientside barchart needs besides the table rows: layout of the server chart, labels and default states. """
+    return {"layout": cached_bar_chart([], "positive")["layout"],
+            "labels": BAR_CHART_LABELS,
+            "defaults": BAR_CHART_DEFAULT_STATES}
+
+
+if CLIENTSIDE_BAR_CHART:
+    # the table already holds the current numbers of all the states, the chart is built from them in the browser (assets/barchart.js)
+    app.clientside_callback(
+        ClientsideFunction(namespace="barchart", function_name="update"),
+        Output('horizontal_barchart', 'figure'),
+        [Input('datatable_id', 'selected_row_ids'),
+         Input('dropval', 'value')],
+        [State('datatable_id', 'data'),
+         State('barchart-config', 'data')])
+else:
+    update_data = app.callback(
+        Output('horizontal_barchart', 'figure'),
+        [Input('datatable_id', 'selected_row_ids'),
+         Input('dropval', 'value')])(update_data)
+
+
+def table_page(source: str, filter_query: str, sort_by: list, page_current: int, page_size: int) -> dict:
+    """ Return one page of the filtered and sorted table data with the number of pages. """
+    with telemetry.stage("data"):
+        return query_table(table_frame(source), filter_query, sort_by, page_current, page_size)
+
+
+# table pages as JSON-like dicts, queried only if they are not in the table cache
+cached_table_page = memoize(table_cache, cached_version)(table_page)
+
+
+if TABLE_MODE == "custom":
+    @app.callback(
+        [Output('datatable_id', 'data'),
+         Output('datatable_id', 'page_count'),
+         Output('datatable_id', 'columns')],
+        [Input('table-source', 'value'),
+         Input('datatable_id', 'page_current'),
+         Input('datatable_id', 'page_size'),
+         Input('datatable_id', 'sort_by'),
+         Input('datatable_id', 'filter_query')])
+    @telemetry.timed("update_table")
+    def update_table(source, page_current, page_size, sort_by, filter_query):
+        """ Update the table with one page of the data filtered and sorted on the server. """
+        page = cached_table_page(source, filter_query, sort_by, page_current, page_size)
+        return page["data"], page["page_count"], rename_datatable_columns(with_date=source == "history")
+
+
+# created after all the chart builders are defined (the table section needs the barchart one)
+app.layout = create_layout()
+
+
+def warmup():
+    """ Build ahead everything derived from the data that is otherwise built on the first requests: the static figures
+    (also those of the lazy sections), the table data and the daily index. Called in the gunicorn master before
+    the workers are forked (see gunicorn.conf.py), so they all start warm and share it. """
+    for name in static_figures.STATIC_FIGURES:
+        static_figures.load(name)
+    for source in ("current", "history"):
+        table_frame(source)
+    states_for_date(int(latest_date().strftime("%Y%m%d")))
+    warm_figure_cache()
+    # the garbage collector would write to the objects of the master (and so copy their pages) in every worker
+    gc.collect()
+    gc.freeze()
+
+
 if __name__ == '__main__':
     app.run_server(port=8052)
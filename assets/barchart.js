@@ -0,0 +1,34 @@
+/* clientside callback of the table barchart (the server one is used with COVID_CLIENTSIDE_CHART=0):
+   the chart is built from the current numbers the table already holds, like build_bar_chart in app.py */
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    barchart: {
+        update: function (selected_row_ids, dropval, rows, config) {
+            var selected = {};
+            (selected_row_ids || []).forEach(function (id) {
+                selected[String(id).split(":")[0]] = true;
+            });
+            // rows stay in the table order, states not in the table fall back to the default ones
+            var chosen = (rows || []).filter(function (row) { return selected[row.state]; });
+            if (chosen.length === 0) {
+                chosen = (rows || []).filter(function (row) { return config.defaults.indexOf(row.state) >= 0; });
+            }
+
+            var layout = JSON.parse(JSON.stringify(config.layout));
+            var colors = layout.template.layout.colorway;
+            var data = chosen.map(function (row, i) {
+                return {
+                    type: "bar", orientation: "h",
+                    x: [row[dropval]], y: [row.state],
+                    name: row.state, legendgroup: row.state, offsetgroup: row.state, alignmentgroup: "True",
+                    marker: {color: colors[i % colors.length]},
+                    hovertemplate: "state=%{y}<br>" + dropval + "=%{x}<extra></extra>",
+                    showlegend: true, textposition: "auto", xaxis: "x", yaxis: "y"
+                };
+            });
+            layout.xaxis.title = {text: config.labels[dropval] + " Cases"};
+            layout.yaxis.categoryarray = chosen.map(function (row) { return row.state; }).reverse();
+            return {data: data, layout: layout};
+        }
+    }
+});
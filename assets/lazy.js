@@ -0,0 +1,21 @@
+/* lazy loading of the layout sections (COVID_LAZY_LAYOUT=1):
+   the "Loading..." trigger of the placeholder is clicked when it scrolls into view, its callback fills the placeholder in */
+
+(function () {
+    var observer = new IntersectionObserver(function (entries) {
+        entries.forEach(function (entry) {
+            if (entry.isIntersecting) {
+                observer.unobserve(entry.target);
+                entry.target.click();
+            }
+        });
+    }, {rootMargin: "300px"});
+
+    // dash renders the layout after this script runs, so watch for the placeholders to appear
+    new MutationObserver(function () {
+        document.querySelectorAll(".lazy-section:not([data-lazy])").forEach(function (el) {
+            el.setAttribute("data-lazy", "observed");
+            observer.observe(el);
+        });
+    }).observe(document.body, {childList: true, subtree: true});
+})();
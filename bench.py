@@ -0,0 +1,264 @@
+# benchmarks of the data load, the callbacks and the figure serialization, run offline against the fixture snapshot
+# in data/fixture (synthetic feeds of the same shape as the API ones, rebuilt with --make-fixture)
+#
+#   python bench.py                                 run them all, print the results
+#   python bench.py --output results.json           ... and save them as JSON
+#   python bench.py --compare base.json new.json    compare two saved runs (exits with 1 if anything got slower)
+
+import os, sys, json, time, argparse, platform, warnings, tempfile, subprocess, statistics, tracemalloc
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(ROOT, "data", "fixture")
+
+# the app reads its settings on import: the fixture only, no refresh thread, figures rendered into a temporary directory
+ENVIRONMENT = {
+    "COVID_SNAPSHOT_DIR": FIXTURE_DIR,
+    "COVID_OFFLINE": "1",
+    "COVID_REFRESH_INTERVAL": "0",
+    "COVID_CACHE_BACKEND": "memory",
+}
+
+# table selections charted by update_data
+SELECTIONS = {
+    "none": [],
+    "one": ["NY"],
+    "ten": ["CA", "TX", "FL", "NY", "PA", "IL", "OH", "GA", "NC", "MI"],
+    "history": ["NY:20210301", "NY:20210201", "CA:20210301"],
+}
+
+# a slower median than the base one by more than this share is reported as regression
+THRESHOLD = 0.1
+
+# the first day the date pickers allow, the sweeps go from it
+FIRST_DAY = 20200122
+
+
+def make_fixture() -> None:
+    """ Build the synthetic snapshot of the four feeds: all the states and territories from 2020-01-13 to 2021-03-07,
+    cumulative counts growing in two waves, some states never reporting hospitalized or recovered, positive cases missing
+    before the first day of the date pickers (like in the API). """
+    import numpy as np
+    import pandas as pd
+    import snapshot
+
+    rng = np.random.RandomState(2020)
+    states = pd.read_json(os.path.join(ROOT, "data", "us-pop.json"))
+    states["pop"] = states["pop"].str.replace(",", "").astype("int64")
+    states = states.sort_values("state")
+    days = pd.date_range("2020-01-13", "2021-03-07")
+    t = np.linspace(0, 1, len(days))
+
+    rows = []
+    for state, pop in zip(states["state"], states["pop"]):
+        first = rng.randint(0, 50)
+        share = rng.uniform(0.05, 0.13)
+        curve = 0.3 / (1 + np.exp(-(t - 0.2) / 0.05)) + 0.7 / (1 + np.exp(-(t - 0.8) / 0.07))
+        positive = np.round(pop * share * (curve - curve[first]) / (curve[-1] - curve[first]))
+        tests = np.round(positive * rng.uniform(8, 15))
+        death = np.round(np.r_[np.zeros(14), positive[:-14]] * rng.uniform(0.01, 0.025))
+        hospitalized = np.round(positive * 0.08) if rng.rand() > 0.3 else np.full(len(days), np.nan)
+        recovered = np.round(np.r_[np.zeros(21), positive[:-21]] * 0.7) if rng.rand() > 0.4 else np.full(len(days), np.nan)
+        frame = pd.DataFrame({"date": days.strftime("%Y%m%d").astype(int), "state": state,
+                              "positive": positive, "negative": tests - positive, "totalTestResults": tests,
+                              "hospitalized": hospitalized, "recovered": recovered, "death": death}).iloc[first:]
+        frame.loc[frame["date"] < FIRST_DAY, "positive"] = np.nan
+        rows.append(frame)
+    # newest first, states in alphabetical order within the day, like the API
+    daily_states = pd.concat(rows).sort_values(["date", "state"], ascending=[False, True], kind="mergesort")
+
+    totals = daily_states.drop(columns="state").groupby("date").sum().sort_index(ascending=False)
+    daily_us = pd.DataFrame({"date": totals.index,
+                             "positive": totals["positive"].values, "negative": totals["negative"].values,
+                             "pending": rng.randint(0, 5000, len(totals)).astype(float),
+                             "totalTestResults": totals["totalTestResults"].values,
+                             "hospitalized": totals["hospitalized"].values, "hospitalizedCumulative": totals["hospitalized"].values,
+                             "recovered": totals["recovered"].values, "death": totals["death"].values,
+                             "positiveIncrease": -np.diff(totals["positive"].values, append=0),
+                             "deathIncrease": -np.diff(totals["death"].values, append=0)})
+    current_states = daily_states[daily_states["date"] == daily_states["date"].max()]
+    latest = daily_us.iloc[:1]
+    current_us = pd.DataFrame({"date": latest["date"].values, "positive": latest["positive"].values,
+                               "negative": latest["negative"].values, "pending": latest["pending"].values,
+                               "death": latest["death"].values, "hospitalizedCumulative": latest["hospitalizedCumulative"].values,
+                               "hospitalizedCurrently": [40199], "inIcuCumulative": [45475], "inIcuCurrently": [8134],
+                               "onVentilatorCumulative": [4281], "onVentilatorCurrently": [2802]})
+
+    snapshot.SNAPSHOT_DIR = FIXTURE_DIR
+    feeds = {"states/daily": daily_states, "us/daily": daily_us, "states/current": current_states, "us/current": current_us}
+    for path, df in feeds.items():
+        df = df.reset_index(drop=True)
+        # stored as compact as the app holds them, the fixture is checked in
+        for col in df.columns:
+            if df[col].dtype.kind == "f" and not df[col].isna().any():
+                df[col] = df[col].astype("int32")
+            elif df[col].dtype.kind == "f":
+                df[col] = df[col].astype("float32")
+            elif df[col].dtype.kind == "i":
+                df[col] = df[col].astype("int32")
+        snapshot.save(path.replace("/", "_"), df, f"https://covidtracking.com/api/v1/{path}.json")
+        print(f"{path:15} {len(df):6} rows")
+
+
+def measure(func, repeat: int, prepare=lambda: None) -> dict:
+    """ Time the calls of func (without tracing, prepare is called before each one and not timed),
+    then trace one more call for the peak of memory allocated in it. """
+    return sweep(lambda _: func(), [None] * repeat, lambda _: prepare())
+
+
+def summarize(times: list, peak: int = None) -> dict:
+    result = {"runs": len(times), "median": statistics.median(times), "min": min(times), "max": max(times),
+              "mean": statistics.mean(times)}
+    if peak is not None:
+        result["peak_bytes"] = peak
+    return result
+
+
+def sweep(func, values: list, prepare=lambda value: None) -> dict:
+    """ Time func for each of the values (one call each, prepare(value) is called before it and not timed),
+    trace the slowest one again for the memory peak. """
+    times = []
+    for value in values:
+        prepare(value)
+        start = time.perf_counter()
+        func(value)
+        times.append(time.perf_counter() - start)
+    slowest = values[times.index(max(times))]
+    prepare(slowest)
+    tracemalloc.start()
+    try:
+        func(slowest)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return summarize(times, peak)
+
+
+COLD_IMPORT = """
+import json, time, resource
+start = time.perf_counter()
+import app
+print(json.dumps({"seconds": time.perf_counter() - start, "maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+"""
+
+
+def cold_import(repeat: int) -> dict:
+    """ Time the import of app.py in a fresh interpreter, with no static figures rendered yet, report its peak RSS. """
+    times, rss = [], []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as figures_dir:
+            env = dict(os.environ, **ENVIRONMENT, COVID_FIGURES_DIR=figures_dir)
+            out = subprocess.run([sys.executable, "-c", COLD_IMPORT], env=env, cwd=ROOT,
+                                 stdout=subprocess.PIPE, check=True).stdout
+        result = json.loads(out.decode().strip().splitlines()[-1])
+        times.append(result["seconds"])
+        rss.append(result["maxrss_kb"] * 1024)
+    return dict(summarize(times), maxrss_bytes=max(rss))
+
+
+def run(repeat: int, step: int) -> dict:
+    """ Run all the benchmarks, return {'meta': ..., 'results': {name: stats}} (times in seconds, memory in bytes). """
+    results = {"import_app_cold": cold_import(max(repeat // 2, 1))}
+
+    # plotly.express warns about deprecated pandas calls of newer pandas versions
+    warnings.simplefilter("ignore", FutureWarning)
+    figures_dir = tempfile.TemporaryDirectory()
+    os.environ.update(ENVIRONMENT, COVID_FIGURES_DIR=figures_dir.name)
+    import plotly
+    import app, charts, utils
+
+    def serialize(figure):
+        return json.dumps(figure, cls=plotly.utils.PlotlyJSONEncoder)
+
+    charts_to_time = {name: getattr(charts, name) for name in
+                      ["cumulative_linechart_us", "cumulative_barchart_us", "total_tests_pie", "hosp_death_daily_increase",
+                       "hospitalized", "corelation_positive_population", "scatter_bar_population_positive",
+                       "create_mortality_barchart", "distribution_by_divisions"]}
+    dates = [date for date in sorted(app.df_by_date) if date >= FIRST_DAY]
+    charts_to_time["positive_map_animation"] = lambda: charts.positive_map_animation(dates[0], dates[-1])
+    charts_to_time["regions_sunburst_animation"] = lambda: charts.regions_sunburst_animation(dates[0], dates[-1])
+    for name, chart in charts_to_time.items():
+        results[f"charts.{name}"] = measure(chart, repeat)
+        figure = chart()
+        results[f"charts.{name}.serialize"] = measure(lambda: serialize(figure), repeat)
+
+    days = [f"{str(d)[:4]}-{str(d)[4:6]}-{str(d)[6:]}" for d in dates[::step]]
+    results["utils.create_df_for_date"] = sweep(utils.create_df_for_date, [str(d) for d in dates[::step]])
+
+    # the callbacks without the Dash wrapper, the figure cache is cleared before each call (or filled in the cached run)
+    update_output = getattr(app.update_output, "__wrapped__", app.update_output)
+    update_data = getattr(app.update_data, "__wrapped__", app.update_data)
+    clear = lambda *_: app.figure_cache.clear()
+
+    results["app.update_output"] = sweep(update_output, days, clear)
+    results["app.update_output.cached"] = sweep(update_output, days, update_output)
+    results["app.update_output.serialize"] = sweep(serialize, [update_output(day) for day in days])
+    for selection, rows in SELECTIONS.items():
+        for dropval in app.BAR_CHART_LABELS:
+            results[f"app.update_data.{selection}.{dropval}"] = measure(lambda: update_data(rows, dropval), repeat, clear)
+
+    figures_dir.cleanup()
+    return {"meta": meta(), "results": results}
+
+
+def meta() -> dict:
+    import pandas, plotly, dash
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "pandas": pandas.__version__, "plotly": plotly.__version__, "dash": dash.__version__, "machine": platform.platform()}
+
+
+def print_results(report: dict) -> None:
+    print(f"{'benchmark':50} {'median ms':>10} {'min ms':>10} {'max ms':>10} {'peak MB':>8}")
+    for name, r in report["results"].items():
+        peak = r.get("peak_bytes", r.get("maxrss_bytes"))
+        print(f"{name:50} {r['median'] * 1e3:10.2f} {r['min'] * 1e3:10.2f} {r['max'] * 1e3:10.2f} "
+              f"{'' if peak is None else f'{peak / 1e6:8.2f}'}")
+
+
+def compare(base: dict, new: dict, threshold: float = THRESHOLD) -> bool:
+    """ Print the medians of both runs side by side, return True if any benchmark got slower than the threshold. """
+    print(f"{base['meta'].get('commit')} -> {new['meta'].get('commit')}")
+    print(f"{'benchmark':50} {'base ms':>10} {'new ms':>10} {'ratio':>7}")
+    slower = False
+    for name in sorted(set(base["results"]) | set(new["results"])):
+        b, n = base["results"].get(name), new["results"].get(name)
+        if b is None or n is None:
+            print(f"{name:50} {'only in ' + ('new' if b is None else 'base'):>29}")
+            continue
+        ratio = n["median"] / b["median"] if b["median"] else float("inf")
+        flag = " slower" if ratio > 1 + threshold else (" faster" if ratio < 1 - threshold else "")
+        slower |= ratio > 1 + threshold
+        print(f"{name:50} {b['median'] * 1e3:10.2f} {n['median'] * 1e3:10.2f} {ratio:7.2f}{flag}")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the data load, callbacks and figure serialization.")
+    parser.add_argument("--output", help="save the results as JSON to this file")
+    parser.add_argument("--repeat", type=int, default=5, help="calls of each benchmark (default 5)")
+    parser.add_argument("--step", type=int, default=7, help="days between the dates of the sweeps (default 7)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two saved runs")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="share of the median reported as slower/faster")
+    parser.add_argument("--make-fixture", action="store_true", help="rebuild the fixture snapshot in data/fixture")
+    args = parser.parse_args()
+
+    if args.make_fixture:
+        make_fixture()
+        return
+    if args.compare:
+        with open(args.compare[0]) as f, open(args.compare[1]) as g:
+            sys.exit(1 if compare(json.load(f), json.load(g), args.threshold) else 0)
+
+    report = run(args.repeat, args.step)
+    print_results(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+# module with cache for the callback outputs (serialized figures)
+#
+# LRUCache lives in the worker, SQLiteCache and RedisCache are shared by all the workers,
+# TieredCache puts the worker cache in front of a shared one
+
+import os, json, time, sqlite3, threading, functools
+from collections import OrderedDict
+
+import plotly
+
+import telemetry
+
+
+class LRUCache:
+    """ Bounded cache of serialized values, the least recently used entry is evicted first. """
+
+    def __init__(self, maxsize: int = 64):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+
+    def get(self, key):
+        """ Return cached value, or None if the key is not cached. """
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value) -> None:
+        """ Cache the value (str or bytes), evict the oldest entries over maxsize. """
+        with self._lock:
+            if key in self._data:
+                self.nbytes -= len(self._data.pop(key))
+            self._data[key] = value
+            self.nbytes += len(value)
+            while len(self._data) > self.maxsize:
+                _, evicted = self._data.popitem(last=False)
+                self.nbytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """ Drop all entries, the counters are kept. """
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def stats(self) -> dict:
+        """ Return size and hit/miss/eviction counters. """
+        with self._lock:
+            return {"size": len(self._data), "maxsize": self.maxsize, "bytes": self.nbytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class SQLiteCache:
+    """ Cache in SQLite file on local disk, shared by all processes on the machine, the oldest entries over maxsize
+    (and those older than ttl seconds, if set) are dropped. """
+
+    def __init__(self, path: str, maxsize: int = 1024, ttl: int = None):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, created REAL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite connections cannot cross threads nor fork, so there is one per thread and process
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key):
+        """ Return cached value, or None if the key is not cached. """
+        oldest = time.time() - self.ttl if self.ttl else 0
+        row = self._connect().execute("SELECT value FROM cache WHERE key = ? AND created >= ?", (key, oldest)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def set(self, key, value) -> None:
+        """ Cache the value, drop the expired entries and the oldest ones over maxsize. """
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)", (key, value, time.time()))
+            if self.ttl:
+                conn.execute("DELETE FROM cache WHERE created < ?", (time.time() - self.ttl,))
+            conn.execute("DELETE FROM cache WHERE key NOT IN (SELECT key FROM cache ORDER BY created DESC LIMIT ?)", (self.maxsize,))
+
+    def clear(self) -> None:
+        """ Drop all entries (for all the processes). """
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache")
+
+    def stats(self) -> dict:
+        """ Return size and hit/miss counters of this process. """
+        size, nbytes = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM cache").fetchone()
+        return {"size": size, "maxsize": self.maxsize, "bytes": nbytes, "hits": self.hits, "misses": self.misses}
+
+
+class RedisCache:
+    """ Cache in Redis, client is anything with redis-py get/set/delete/scan_iter (e.g. fakeredis for local use). """
+
+    def __init__(self, client=None, url: str = "redis://localhost:6379/0", prefix: str = "covidtrackboard:", ttl: int = None):
+        if client is None:
+            import redis  # optional dependency, needed only for this backend
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """ Return cached value, or None if the key is not cached. """
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value.decode() if isinstance(value, bytes) else value
+
+    def set(self, key, value) -> None:
+        """ Cache the value, it expires after ttl seconds (if set). """
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+
+    def clear(self) -> None:
+        """ Drop all entries with our prefix. """
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+    def stats(self) -> dict:
+        """ Return hit/miss counters of this process. """
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class TieredCache:
+    """ Worker cache in front of a shared cache, values found in the shared one are kept in the worker too. """
+
+    def __init__(self, local: LRUCache, shared):
+        self.local = local
+        self.shared = shared
+
+    def get(self, key):
+        """ Return cached value from the worker or the shared cache, or None. """
+        value = self.local.get(key)
+        if value is None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    def set(self, key, value) -> None:
+        """ Cache the value in both caches. """
+        self.local.set(key, value)
+        self.shared.set(key, value)
+
+    def clear(self) -> None:
+        """ Drop the worker entries only, the shared entries are keyed by data and render version and expire after their ttl. """
+        self.local.clear()
+
+    def stats(self) -> dict:
+        """ Return stats of both caches. """
+        return {"local": self.local.stats(), "shared": self.shared.stats()}
+
+
+# seconds the entries of the shared caches live, the keys hold user input (table filters), so they must not pile up
+CACHE_TTL = int(os.environ.get("COVID_CACHE_TTL", 24 * 60 * 60))
+
+
+def create_cache(backend: str = None):
+    """ Create the cache configured by COVID_CACHE_BACKEND: 'memory' (default), 'sqlite' or 'redis'. """
+    backend = backend or os.environ.get("COVID_CACHE_BACKEND", "memory")
+    local = LRUCache(int(os.environ.get("COVID_FIGURE_CACHE_SIZE", 64)))
+    if backend == "memory":
+        return local
+    if backend == "sqlite":
+        path = os.environ.get("COVID_CACHE_PATH", os.path.join(os.path.dirname(__file__), "data", "cache.sqlite"))
+        return TieredCache(local, SQLiteCache(path, ttl=CACHE_TTL or None))
+    if backend == "redis":
+        return TieredCache(local, RedisCache(url=os.environ.get("COVID_CACHE_URL", "redis://localhost:6379/0"), ttl=CACHE_TTL or None))
+    raise ValueError(f"Unknown cache backend: {backend}")
+
+
+def memoize(cache, version=lambda: ""):
+    """ Decorator caching the JSON of what the function returns, keyed by data version, function name and arguments (must be JSON-able). """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            key = f"{version()}:{func.__name__}:{json.dumps(args)}"
+            with telemetry.stage("cache"):
+                value = cache.get(key)
+            if value is None:
+                result = func(*args)
+                with telemetry.stage("serialize"):
+                    value = json.dumps(result, cls=plotly.utils.PlotlyJSONEncoder)
+                cache.set(key, value)
+            with telemetry.stage("deserialize"):
+                return json.loads(value)
+        return wrapper
+    return decorator
@@ -1,4 +1,3 @@
-import requests, os
 import pandas as pd
 import numpy as np
 import heapq
@@ -8,31 +7,24 @@ import plotly.express as px
 import plotly.graph_objs as go
 from plotly.subplots import make_subplots
 
+# the global data - loaded once per process by the data store, there will be a local reference in each function
+import datastore
+import figures
+import metrics
+import sunburst
+import telemetry
 
-def get_api_data(source: str):
-    """ Get data from api, return dateframe. """
-    data = requests.get(source)
-    return pd.read_json(data.text)
-
-
-# get the global data - there will be a local copy in each function
-daily_states_df = get_api_data("https://covidtracking.com/api/v1/states/daily.json")
-daily_us_df = get_api_data("https://covidtracking.com/api/v1/us/daily.json")
-current_state_df = get_api_data("https://covidtracking.com/api/v1/states/current.json")
-current_us_df = get_api_data("https://covidtracking.com/api/v1/us/current.json")
-
-
-pop_df = pd.read_json(os.path.join(os.path.dirname(__file__), "data", "us-pop.json"))
 
 def cumulative_linechart_us():
     """ Create linechart showing the cummulative progression in time. """
+    daily_us_df = datastore.daily_us_df
     fig = go.Figure()
-    fig.add_trace(go.Scatter(x=daily_us_df["dateChecked"].str.split("T").str[0], y=daily_us_df["totalTestResults"], mode='lines', name='Tested'))
-    fig.add_trace(go.Scatter(x=daily_us_df["dateChecked"].str.split("T").str[0], y=daily_us_df["negative"], mode='lines', name='Negative'))
-    fig.add_trace(go.Scatter(x=daily_us_df["dateChecked"].str.split("T").str[0], y=daily_us_df["positive"], mode='lines', name='Positive'))
-    fig.add_trace(go.Scatter(x=daily_us_df["dateChecked"].str.split("T").str[0], y=daily_us_df["hospitalized"], mode='lines', name='Hospitalized'))
-    fig.add_trace(go.Scatter(x=daily_us_df["dateChecked"].str.split("T").str[0], y=daily_us_df["recovered"], mode='lines', name='Recovered'))
-    fig.add_trace(go.Scatter(x=daily_us_df["dateChecked"].str.split("T").str[0], y=daily_us_df["death"], mode='lines', name='Fatal'))
+    fig.add_trace(go.Scatter(x=daily_us_df.index, y=daily_us_df["totalTestResults"], mode='lines', name='Tested'))
+    fig.add_trace(go.Scatter(x=daily_us_df.index, y=daily_us_df["negative"], mode='lines', name='Negative'))
+    fig.add_trace(go.Scatter(x=daily_us_df.index, y=daily_us_df["positive"], mode='lines', name='Positive'))
+    fig.add_trace(go.Scatter(x=daily_us_df.index, y=daily_us_df["hospitalized"], mode='lines', name='Hospitalized'))
+    fig.add_trace(go.Scatter(x=daily_us_df.index, y=daily_us_df["recovered"], mode='lines', name='Recovered'))
+    fig.add_trace(go.Scatter(x=daily_us_df.index, y=daily_us_df["death"], mode='lines', name='Fatal'))
     fig.update_layout(plot_bgcolor='rgba(0,0,0,0)', title="Progression in Time")
 
     fig.update_layout(
@@ -48,6 +40,7 @@ def cumulative_linechart_us():
 
 def cumulative_barchart_us():
     """ Create barchart for USA cumulative data. """
+    current_us_df = datastore.current_us_df
     fig = go.Figure()
     fig.add_trace(go.Bar(x=["Positive"], y=current_us_df["positive"], name='Positive'))
     fig.add_trace(go.Bar(x=["Hospitalized"], y=current_us_df["hospitalizedCumulative"], name='Hospitalized'))
@@ -59,8 +52,9 @@ def cumulative_barchart_us():
 
 def total_tests_pie():
     """ Create piechart for total test. """
+    current_us_df = datastore.current_us_df
     fig = px.pie(current_us_df,
-                 values=[current_us_df["positive"][0], current_us_df["negative"][0], current_us_df["pending"][0]], 
+                 values=[current_us_df["positive"].iloc[0], current_us_df["negative"].iloc[0], current_us_df["pending"].iloc[0]], 
                  names=['Positive', 'Negative', 'Pending'],
                  title='Tests Total')
     fig.update_layout(legend_orientation="h", margin=dict(l=20, r=20))
@@ -69,13 +63,14 @@ def total_tests_pie():
 
 def hosp_death_daily_increase():
     """ Create line chart for daily increase. """
+    daily_us_df = datastore.daily_us_df
     fig = make_subplots(specs=[[{"secondary_y": True}]])
     fig.add_trace(
-        go.Scatter(x=daily_us_df["dateChecked"].str.split("T").str[0], y=daily_us_df["deathIncrease"], name="Fatal Cases", mode='lines'),
+        go.Scatter(x=daily_us_df.index, y=daily_us_df["deathIncrease"], name="Fatal Cases", mode='lines'),
         secondary_y=False,
     )
     fig.add_trace(
-        go.Scatter(x=daily_us_df["dateChecked"].str.split("T").str[0], y=daily_us_df["positiveIncrease"], name="Positive Cases", mode='lines'),
+        go.Scatter(x=daily_us_df.index, y=daily_us_df["positiveIncrease"], name="Positive Cases", mode='lines'),
         secondary_y=True,
     )
     fig.update_layout(
@@ -96,17 +91,18 @@ def hosp_death_daily_increase():
 
 def hospitalized():
     """ Create horizontal barchart for hospitalized cases. """
+    current_us_df = datastore.current_us_df
     fig = go.Figure(data=[
         go.Bar(name='Cumulative',
                orientation='h',
                y=["Hospitalized", "In ICU", "On Ventilator"],
-               x=[current_us_df["hospitalizedCumulative"][0], current_us_df["inIcuCurrently"][0], current_us_df["onVentilatorCurrently"][0]],
+               x=[current_us_df["hospitalizedCumulative"].iloc[0], current_us_df["inIcuCurrently"].iloc[0], current_us_df["onVentilatorCurrently"].iloc[0]],
                showlegend=False),
 
         go.Bar(name='Current',
                orientation='h',
                y=["Hospitalized", "In ICU", "On Ventilator"],
-               x=[current_us_df["hospitalizedCurrently"][0], current_us_df["inIcuCumulative"][0], current_us_df["onVentilatorCumulative"][0]],
+               x=[current_us_df["hospitalizedCurrently"].iloc[0], current_us_df["inIcuCumulative"].iloc[0], current_us_df["onVentilatorCumulative"].iloc[0]],
                showlegend=False)
     ])
 
@@ -116,9 +112,7 @@ def hospitalized():
 
 def corelation_positive_population():
     """ Create scatter chart for corelation. """
-    pop_df = pd.read_json(os.path.join(os.path.dirname(__file__), "data", "us-pop.json"))
-    state_df = pd.read_json(os.path.join(os.path.dirname(__file__), "data", "state-current.json"))
-    df = pd.merge(state_df, pop_df, on="state")
+    df = pd.merge(datastore.current_state_df, datastore.pop_df, on="state")
 
     fig = go.Figure()
     fig.add_trace(go.Scatter(x=df["pop"], y=df["positive"].fillna(0), mode='markers', text=df['state name'].fillna(0)))
@@ -139,12 +133,11 @@ def corelation_positive_population():
 
 def scatter_bar_population_positive():
     """ Create barchart/scatter for us states using subplots. """
-    pop_df = pd.read_json(os.path.join(os.path.dirname(__file__), "data", "us-pop.json"))
-    df = pd.merge(current_state_df, pop_df, on="state")
-    pint = [int(i.replace(",",""))for i in df["pop"]]
+    current_state_df = datastore.current_state_df
+    df = pd.merge(current_state_df, datastore.pop_df, on="state")
 
-    y_positive_df = np.rint(df["positive"] / pint * 1_000_000)
-    y_population_df = pint
+    y_positive_df = np.rint(metrics.latest("cases_per_million").reindex(df["state"].astype(str)).values)
+    y_population_df = df["pop"]
     x_state_df = current_state_df["state"]
 
     fig = make_subplots(rows=2, cols=1,
@@ -233,9 +226,9 @@ def scatter_bar_population_positive():
 
 def create_mortality_barchart():
     """ Create mortality barchart. """
-    grouped_df = daily_states_df.groupby("state", as_index=False)[["totalTestResults", "positive", "hospitalized", "recovered", "death"]].sum()
-    grouped_df["mortality"] = grouped_df["death"]/grouped_df["positive"] * 100
-    fig = px.bar(grouped_df, y='mortality', x='state', text='mortality')
+    # from the latest cumulative numbers of each state
+    mortality_df = metrics.latest("mortality").rename_axis("state").reset_index()
+    fig = px.bar(mortality_df, y='mortality', x='state', text='mortality')
     fig.update_traces(texttemplate='%{text:.2s}', textposition='outside')
 
     fig.update_layout(uniformtext_minsize=8, 
@@ -261,14 +254,16 @@ def create_mortality_barchart():
 
 def distribution_by_divisions():
     """ create sunburst chart for divisions, regions, states """
+    current_state_df = datastore.current_state_df
+    daily_states_df = datastore.daily_states_df
+    pop_df = datastore.pop_df
 
-    df = pd.read_json(os.path.join(os.path.dirname(__file__), "data", "sunburst.json"))
     # print(df.head())
     # print(current_state_df.columns)
     # print(current_state_df.head())
 
     loc_current_state_df = current_state_df[["state", "totalTestResults", "positive", "negative", "hospitalized", "recovered", "death"]]
-    loc_daily_states_df = daily_states_df[["dateChecked","state", "totalTestResults", "positive", "negative", "hospitalized", "recovered", "death"]]
+    loc_daily_states_df = daily_states_df[["date", "state", "totalTestResults", "positive", "negative", "hospitalized", "recovered", "death"]]
     # print(loc_current_state_df.head())
     # print(loc_daily_states_df.head())
     # print(pop_df.head())
@@ -290,30 +285,7 @@ def distribution_by_divisions():
     mrg_daily_states_df["total death usa"] = mrg_daily_states_df["death"].sum()
 
 
-    mrg_current_states_df["region"] = "None"
-    mrg_current_states_df["division"] = "None"
-    # print(mrg_current_states_df)
-
-    mrg_daily_states_df["region"] = "None"
-    mrg_daily_states_df["division"] = "None"
-
-    # fill the regions and divisions to dataframe
-    for region in regions:
-        for region_name, region_list in region.items():
-            for division in region_list:
-                for division_name, states in division.items():
-                    for state in states:
-                        mrg_daily_states_df.loc[(mrg_daily_states_df["state name"] == state),"division"]=division_name
-                        mrg_daily_states_df.loc[(mrg_daily_states_df["state name"] == state),"region"]=region_name
-
-    for region in regions:
-        for region_name, region_list in region.items():
-            for division in region_list:
-                for division_name, states in division.items():
-                    for state in states:
-                        mrg_current_states_df.loc[(mrg_current_states_df["state name"] == state),"division"]=division_name
-                        mrg_current_states_df.loc[(mrg_current_states_df["state name"] == state),"region"]=region_name
-
+    # the regions and divisions come already merged from pop_df
 
     cols = ["totalTestResults", "positive", "negative", "hospitalized", "recovered", "death"]
     mrg_current_states_df[cols] = mrg_current_states_df[cols].replace({0:np.nan})
@@ -334,3 +306,86 @@ def distribution_by_divisions():
                 )
         )
     return fig
+
+
+# animation frames are switched every 200 ms, redrawn whole (choropleth and sunburst traces cannot transition)
+FRAME_ARGS = {"frame": {"duration": 200, "redraw": True}, "mode": "immediate", "transition": {"duration": 0}}
+
+
+def _frame_name(date: int) -> str:
+    return f"{str(date)[:4]}-{str(date)[4:6]}-{str(date)[6:]}"
+
+
+def _play_controls(names: list) -> dict:
+    """ Return the layout of the Play/Pause buttons and of the slider over the frames (plain dicts, validating
+    hundreds of slider steps is slow). """
+    return {"updatemenus": [{"type": "buttons", "direction": "left",
+                             "x": 0.1, "y": 0, "xanchor": "right", "yanchor": "top",
+                             "pad": {"r": 10, "t": 60},
+                             "buttons": [{"label": "Play", "method": "animate", "args": [None, dict(FRAME_ARGS, fromcurrent=True)]},
+                                         {"label": "Pause", "method": "animate", "args": [[None], dict(FRAME_ARGS, frame={"duration": 0, "redraw": False})]}]}],
+            "sliders": [{"active": max(len(names) - 1, 0),
+                         "x": 0.1, "y": 0, "len": 0.9, "xanchor": "left", "yanchor": "top",
+                         "pad": {"t": 50},
+                         "steps": [{"label": name, "method": "animate", "args": [[name], FRAME_ARGS]} for name in names]}]}
+
+
+def positive_map_animation(start_date: int, end_date: int):
+    """ Create choropleth of positive cases playing the days between start and end date (as int, e.g. 20210307) in the browser. """
+    with telemetry.stage("data"):
+        states, dates, values = metrics.for_range("positive", start_date, end_date)
+        # states that did not report yet have no cases
+        z = np.nan_to_num(values).astype("int64")
+        names = [_frame_name(d) for d in dates]
+
+    with telemetry.stage("figure"):
+        fig = go.Figure(data=go.Choropleth(locations=states,
+                                           z=z[:, -1] if len(dates) else [],
+                                           zmin=0,
+                                           zmax=max(int(z.max()) if z.size else 0, 1),
+                                           autocolorscale=True,
+                                           colorscale='Bluered',
+                                           colorbar_title="Positive",
+                                           locationmode='USA-states'))
+        fig.update_layout(title_text='Progression of Reported Cases by State',
+                          height=600,
+                          geo=dict(scope='usa',
+                                   projection=go.layout.geo.Projection(type='albers usa'),
+                                   lakecolor='rgb(255, 255, 255)'
+                                   ),
+                          margin=dict(l=1,
+                                      r=1,
+                                      ),
+                          )
+        # the frames carry only the z values of the one trace, the rest comes from the figure
+        figure = fig.to_dict()
+        figure["layout"].update(_play_controls(names))
+        figure["frames"] = [{"name": name, "data": [{"type": "choropleth", "z": column}], "traces": [0]} for name, column in zip(names, z.T.tolist())]
+    return figure
+
+
+def regions_sunburst_animation(start_date: int, end_date: int):
+    """ Create sunburst of positive cases by region, division and state playing the days between start and end date
+    (as int, e.g. 20210307) in the browser, sliced from the sunburst cube. """
+    with telemetry.stage("data"):
+        nodes = sunburst.for_range(start_date, end_date)
+        names = [_frame_name(d) for d in nodes["dates"]]
+
+    with telemetry.stage("figure"):
+        # missing colors as None, the JSON encoder goes over the whole figure again if it finds any NaN
+        colors = np.where(np.isnan(nodes["colors"]), None, nodes["colors"])
+        last = {key: nodes[key] for key in ("ids", "labels", "parents")}
+        last["values"] = nodes["values"][:, -1] if len(names) else np.array([])
+        last["colors"] = colors[:, -1] if len(names) else np.array([])
+        figure = figures.regions_sunburst(last)
+        # the same nodes in all the frames, they carry only the values and colors, the color scale is fixed over the range
+        reported = nodes["colors"][~np.isnan(nodes["colors"])]
+        coloraxis = dict(figure["layout"]["coloraxis"], **({"cmin": float(reported.min()), "cmax": float(reported.max())} if reported.size else {}))
+        figure["layout"] = dict(figure["layout"], coloraxis=coloraxis, title={"text": "Progression of Positive Cases by Region"},
+                                **_play_controls(names))
+        colors = colors.T.tolist()
+        figure["frames"] = [{"name": name, "data": [{"type": "sunburst", "values": values,
+                                                     "marker": {"coloraxis": "coloraxis", "colors": frame_colors}}],
+                             "traces": [0]}
+                            for name, values, frame_colors in zip(names, nodes["values"].T.tolist(), colors)]
+    return figure
@@ -0,0 +1,344 @@
+# module holding the global data - every feed is downloaded and parsed only once per process
+
+import os, logging, hashlib, threading
+import requests
+import numpy as np
+import pandas as pd
+
+import api
+import snapshot
+from geography import state_regions
+
+log = logging.getLogger(__name__)
+
+
+# COVID_API_URL points the app to another server with the same paths, e.g. a local stand-in serving the JSON files
+API_URL = os.environ.get("COVID_API_URL", "https://covidtracking.com/api/v1")
+
+# API feeds used across the app
+FEEDS = {
+    "daily_states": f"{API_URL}/states/daily.json",
+    "daily_us": f"{API_URL}/us/daily.json",
+    "current_state": f"{API_URL}/states/current.json",
+    "current_us": f"{API_URL}/us/current.json",
+}
+
+# columns used by the app (the API has ~50 per feed) and how they are held in memory:
+# 'category', 'int32', or 'count' - the smallest numeric type holding the counts exactly
+SCHEMAS = {
+    FEEDS["daily_states"]: {
+        "date": "int32", "state": "category",
+        "positive": "count", "negative": "count", "totalTestResults": "count",
+        "hospitalized": "count", "recovered": "count", "death": "count",
+    },
+    FEEDS["daily_us"]: {
+        "date": "int32",
+        "positive": "count", "negative": "count", "pending": "count", "totalTestResults": "count",
+        "hospitalized": "count", "hospitalizedCumulative": "count", "recovered": "count", "death": "count",
+        "positiveIncrease": "count", "deathIncrease": "count",
+    },
+    FEEDS["current_state"]: {
+        "date": "int32", "state": "category",
+        "positive": "count", "negative": "count", "totalTestResults": "count",
+        "hospitalized": "count", "recovered": "count", "death": "count",
+    },
+    FEEDS["current_us"]: {
+        "date": "int32",
+        "positive": "count", "negative": "count", "pending": "count", "death": "count",
+        "hospitalizedCumulative": "count", "hospitalizedCurrently": "count",
+        "inIcuCumulative": "count", "inIcuCurrently": "count",
+        "onVentilatorCumulative": "count", "onVentilatorCurrently": "count",
+    },
+}
+
+
+def _count(s: pd.Series) -> pd.Series:
+    """ Convert counts to int32 if there are no missing values, else float32 if it is exact (below 2**24), else float64.
+    Counts already in that type are not copied. """
+    if s.dtype.kind not in "iuf":
+        s = pd.to_numeric(s)
+    if s.isna().any():
+        return s.astype("float32", copy=False) if not s.abs().max() >= 2 ** 24 else s.astype("float64", copy=False)
+    if s.empty or (s.min() >= np.iinfo("int32").min and s.max() <= np.iinfo("int32").max):
+        return s.astype("int32", copy=False)
+    return s.astype("int64", copy=False)
+
+
+def _owner(values: np.ndarray) -> np.ndarray:
+    """ Return the array owning the memory the values are a view of. """
+    while isinstance(values.base, np.ndarray):
+        values = values.base
+    return values
+
+
+def read_only(df: pd.DataFrame) -> pd.DataFrame:
+    """ Mark the NumPy arrays holding the dataframe read-only and return it to be used from now on (a shallow copy,
+    the columns handed out before stay writable). Workers forked from a preloaded master share the pages of the arrays
+    as long as nobody writes to them, an in-place write raises instead of quietly copying them. """
+    for col in df.columns:
+        values = df[col].values
+        if isinstance(values, pd.Categorical):
+            values = values.codes
+        if isinstance(values, np.ndarray):
+            _owner(values).flags.writeable = False
+    return df.copy(deep=False)
+
+
+def compact(df: pd.DataFrame, schema: dict) -> pd.DataFrame:
+    """ Keep only the schema columns in their compact types, indexed by the day (datetime64 parsed from 'date'),
+    read-only, log the memory before and after. """
+    before = df.memory_usage(deep=True).sum()
+    data = {}
+    for col, kind in schema.items():
+        if col not in df.columns:
+            continue
+        if kind == "count":
+            data[col] = _count(df[col])
+        else:
+            data[col] = df[col].astype(kind, copy=False)
+    # the only copy of the columns (e.g. memory-mapped from the snapshot), into one block per dtype
+    compacted = pd.DataFrame(data)
+    if "date" in compacted:
+        # the days parsed once, shared by the time-series charts, the frames can be sliced by dates
+        # (newest first, e.g. df.loc[pd.Timestamp("2021-03-07"):pd.Timestamp("2021-03-01")])
+        days = np.unique(compacted["date"].values)
+        parsed = pd.to_datetime(days.astype(str), format="%Y%m%d").values
+        compacted.index = pd.DatetimeIndex(parsed[np.searchsorted(days, compacted["date"].values)], name="day")
+    log.info("Data compacted from %.1f MB to %.1f MB.", before / 1e6, compacted.memory_usage(deep=True).sum() / 1e6)
+    return read_only(compacted)
+
+
+# how often (in seconds) the background thread checks the API for new days, 0 turns it off
+REFRESH_INTERVAL = int(os.environ.get("COVID_REFRESH_INTERVAL", 6 * 60 * 60))
+
+
+def _grow(buffer: np.ndarray, size: int) -> np.ndarray:
+    grown = np.empty(size, dtype=buffer.dtype)
+    grown[:len(buffer)] = buffer
+    return grown
+
+
+def read_columns(records, schema: dict) -> pd.DataFrame:
+    """ Collect the schema columns of the records (any iterable of dicts, e.g. streamed from the API) into typed buffers,
+    return dataframe of them - the records are not kept, the other fields are dropped right away.
+    Numbers are read as float64 (exact for the counts, None as NaN), strings as category codes. """
+    size, rows = 4096, 0
+    numbers = {col: np.empty(size) for col, kind in schema.items() if kind != "category"}
+    codes = {col: np.empty(size, dtype="int32") for col, kind in schema.items() if kind == "category"}
+    levels = {col: {} for col in codes}
+    present = set()
+    for record in records:
+        if rows == size:
+            size *= 2
+            numbers = {col: _grow(buffer, size) for col, buffer in numbers.items()}
+            codes = {col: _grow(buffer, size) for col, buffer in codes.items()}
+        for col, buffer in numbers.items():
+            value = record.get(col)
+            buffer[rows] = np.nan if value is None else value
+        for col, buffer in codes.items():
+            value = record.get(col)
+            buffer[rows] = -1 if value is None else levels[col].setdefault(value, len(levels[col]))
+        present.update(record.keys() & schema.keys())
+        rows += 1
+
+    data = {}
+    for col in schema:
+        # like a dataframe of the records, a field not in any of them is no column
+        if col not in present:
+            continue
+        if col in codes:
+            # categories sorted, the same astype('category') makes, the codes in order of appearance are mapped to them
+            categories = sorted(levels[col])
+            position = {value: i for i, value in enumerate(categories)}
+            remap = np.array([position[value] for value in levels[col]] + [-1], dtype="int32")
+            data[col] = pd.Categorical.from_codes(remap[codes[col][:rows]], categories=categories)
+        else:
+            data[col] = numbers[col][:rows]
+    return pd.DataFrame(data)
+
+
+def read_feed(source: str, records) -> pd.DataFrame:
+    """ Read the records of the API source into the compacted dataframe. """
+    return compact(read_columns(records, SCHEMAS[source]), SCHEMAS[source])
+
+
+def _validators(source: str) -> dict:
+    """ Return the ETag/Last-Modified the snapshot of the source was downloaded with, for a conditional request. """
+    meta = snapshot.read_meta(snapshot.snapshot_name(source)) or {}
+    return {"etag": meta.get("etag"), "last_modified": meta.get("last_modified")}
+
+
+# ETag/Last-Modified of the frames this process holds - the shared snapshot can be newer (saved by another worker),
+# its validators would get 304 for data this process does not have
+_held_validators = {}
+
+
+def get_api_data(sources: list) -> list:
+    """ Get data from local snapshots if they are fresh, the others from API sources all at once (and snapshot them),
+    return list of dataframes. """
+    stale = [source for source in sources if not snapshot.is_fresh(snapshot.snapshot_name(source))]
+    fetched = api.fetch_all(stale, {source: _validators(source) for source in stale}, decode=read_feed)
+    frames = []
+    for source in sources:
+        name = snapshot.snapshot_name(source)
+        result = fetched.get(source)
+        if isinstance(result, tuple) and result[0] is not None:
+            df = result[0]
+            snapshot.save(name, df, source, **result[1])
+            _held_validators[source] = result[1]
+            frames.append(df)
+            continue
+        if isinstance(result, tuple):
+            # not modified since the snapshot
+            snapshot.touch(name)
+            validators = result[1]
+        else:
+            # read before the snapshot is loaded, a newer one saved in between only makes the next request unconditional
+            validators = _validators(source)
+        if isinstance(result, Exception):
+            # API is slow or gone - a stale snapshot is still better than nothing
+            if snapshot.read_meta(name) is None or not isinstance(result, (requests.RequestException, ValueError)):
+                raise result
+            log.warning("Cannot fetch %s (%s), using the stale snapshot.", source, result)
+        # compact again, the snapshot can be from an older version with other columns
+        frames.append(compact(snapshot.load(name), SCHEMAS[source]))
+        _held_validators[source] = validators
+    return frames
+
+
+# get the global API data - imported modules are cached by python, so this runs once per process
+daily_states_df, daily_us_df, current_state_df, current_us_df = get_api_data(list(FEEDS.values()))
+
+
+def load_states() -> pd.DataFrame:
+    """ Load the state dimension table: state (abbreviation), state name, pop (int), region and division ("None" for territories). """
+    # population scrapped from wikipedia, formatted like "39,512,223"
+    states = pd.read_json(os.path.join(os.path.dirname(__file__), "data", "us-pop.json"))
+    states["pop"] = states["pop"].str.replace(",", "").astype("int32")
+    states = pd.merge(states, state_regions(), on="state name", how="left").fillna({"region": "None", "division": "None"})
+    return read_only(states[["state", "state name", "pop", "region", "division"]])
+
+
+# static data about the states - parsed once, shared by all the charts and callbacks
+pop_df = load_states()
+
+# bumped on every refresh, derived data (merged frames, indexes, cached figures) can be keyed by it
+version = 0
+
+
+def memory_usage() -> dict:
+    """ Return memory held by each of the global dataframes in bytes. """
+    frames = {"daily_states_df": daily_states_df, "daily_us_df": daily_us_df, "current_state_df": current_state_df,
+              "current_us_df": current_us_df, "pop_df": pop_df}
+    return {name: int(df.memory_usage(deep=True).sum()) for name, df in frames.items()}
+
+
+def data_version() -> str:
+    """ Identify the data held the same way in every process (unlike version): latest day and number of daily rows,
+    hash of the current data (it can change without a new day). """
+    current = hashlib.sha1()
+    for df in (current_state_df, current_us_df):
+        current.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return f"{daily_states_df['date'].max()}-{len(daily_states_df)}-{len(daily_us_df)}-{current.hexdigest()[:8]}"
+
+
+_refresh_lock = threading.Lock()
+_listeners = []
+_refresher = None
+
+
+def on_refresh(func):
+    """ Register function called (without arguments) after new data were swapped in, usable as decorator. """
+    _listeners.append(func)
+    return func
+
+
+def _append_new_days(held: pd.DataFrame, fetched: pd.DataFrame, schema: dict) -> pd.DataFrame:
+    """ Put the rows newer than the latest date already held on top of the held frame (feeds are newest first). """
+    new_rows = fetched[fetched["date"] > held["date"].max()]
+    if new_rows.empty:
+        return held
+    # categories of the new rows differ, concat falls back to objects, so the columns are compacted again
+    return compact(pd.concat([new_rows, held], ignore_index=True), schema)
+
+
+def refresh() -> bool:
+    """ Append the new days of daily data, replace the current data and notify the listeners. Return True if anything changed. """
+    global daily_states_df, daily_us_df, current_state_df, current_us_df, version
+    with _refresh_lock:
+        # all the feeds at once, those not changed since the data held are not downloaded
+        sources = list(FEEDS.values())
+        fetched = api.fetch_all(sources, {source: _held_validators.get(source, {}) for source in sources}, decode=read_feed)
+        for result in fetched.values():
+            if isinstance(result, Exception):
+                raise result
+        held = dict(zip(sources, (daily_states_df, daily_us_df, current_state_df, current_us_df)))
+        new = {source: held[source] if df is None else df for source, (df, _) in fetched.items()}
+        # the feeds downloaded again are what the validators now stand for, also if nothing in them is used
+        _held_validators.update({source: validators for source, (df, validators) in fetched.items() if df is not None})
+
+        new_daily_states_df = _append_new_days(daily_states_df, new[FEEDS["daily_states"]], SCHEMAS[FEEDS["daily_states"]])
+        new_daily_us_df = _append_new_days(daily_us_df, new[FEEDS["daily_us"]], SCHEMAS[FEEDS["daily_us"]])
+        # the current data are replaced whole, they can change without a new day
+        new_current_state_df = new[FEEDS["current_state"]]
+        new_current_us_df = new[FEEDS["current_us"]]
+        if (new_daily_states_df is daily_states_df and new_daily_us_df is daily_us_df
+                and new_current_state_df.equals(current_state_df) and new_current_us_df.equals(current_us_df)):
+            return False
+
+        # swap in all at once, requests in flight keep working with the old frames
+        daily_states_df, daily_us_df, current_state_df, current_us_df = \
+            new_daily_states_df, new_daily_us_df, new_current_state_df, new_current_us_df
+        version += 1
+        log.info("Data refreshed to %s (version %s).", daily_us_df["date"].max(), version)
+
+        # the data are swapped in already, the derived ones must follow them even if the snapshot cannot be saved
+        try:
+            for key, df in zip(FEEDS, (daily_states_df, daily_us_df, current_state_df, current_us_df)):
+                snapshot.save(snapshot.snapshot_name(FEEDS[key]), df, FEEDS[key], **fetched[FEEDS[key]][1])
+        except Exception:
+            log.exception("Saving the refreshed data failed, the snapshot stays behind.")
+
+    for func in _listeners:
+        try:
+            func()
+        except Exception:
+            log.exception("Refresh listener %s failed.", getattr(func, "__qualname__", func))
+    return True
+
+
+def _refresh_loop(interval: int, stop: threading.Event):
+    while not stop.wait(interval):
+        try:
+            refresh()
+        except Exception:
+            log.exception("Data refresh failed, keeping the current data.")
+
+
+def start_refresher(interval: int = None) -> None:
+    """ Start the background refresh thread in this process (once), threads do not survive fork, so call it in each worker. """
+    global _refresher
+    interval = REFRESH_INTERVAL if interval is None else interval
+    if interval <= 0 or (_refresher is not None and _refresher[0] == os.getpid()):
+        return
+    stop = threading.Event()
+    thread = threading.Thread(target=_refresh_loop, args=(interval, stop), name="data-refresher", daemon=True)
+    thread.start()
+    _refresher = (os.getpid(), thread, stop)
+
+
+def stop_refresher() -> None:
+    """ Stop the background refresh thread of this process. """
+    global _refresher
+    if _refresher is not None and _refresher[0] == os.getpid():
+        _refresher[2].set()
+        _refresher = None
+
+
+if __name__ == "__main__":
+    # report the memory footprint of the data, raw API data vs. what the app holds
+    for key, source in FEEDS.items():
+        raw = pd.DataFrame(api.fetch(source)[0])
+        held = compact(raw, SCHEMAS[source])
+        print(f"{key:15} {raw.shape[1]:3} -> {held.shape[1]:3} columns, "
+              f"{raw.memory_usage(deep=True).sum() / 1e6:7.2f} MB -> {held.memory_usage(deep=True).sum() / 1e6:7.2f} MB")
@@ -0,0 +1,274 @@
+# module with fast builders of the callback charts - plain figure dicts, the same plotly.express/graph_objs would build,
+# but without the validation: the layouts are ready-made skeletons and only the data arrays are filled in
+#
+# check they still match the plotly built charts (e.g. after plotly upgrade) with:  python figures.py
+
+import os, re, sys, json, datetime, functools
+
+import numpy as np
+import plotly
+import plotly.io as pio
+import plotly.express as px
+
+import telemetry
+
+# the default template, the validated figures carry it in the layout too
+TEMPLATE = pio.templates[pio.templates.default].to_plotly_json()
+
+MAP_LAYOUT = {
+    "geo": {"lakecolor": "rgb(255, 255, 255)", "projection": {"type": "albers usa"}, "scope": "usa"},
+    "height": 600,
+    "margin": {"l": 1, "r": 1},
+    "title": {"text": "Density by State"},
+    "template": TEMPLATE,
+}
+
+PIE_LAYOUT = {
+    "height": 600,
+    "legend": {"tracegroupgap": 0, "x": 1, "y": 1},
+    "title": {"text": "Distribution by State"},
+    "uniformtext": {"minsize": 9, "mode": "hide"},
+    "template": TEMPLATE,
+}
+
+SCATTER_LAYOUT = {
+    "autosize": True,
+    "height": 600,
+    "margin": {"l": 10, "r": 10},
+    "plot_bgcolor": "rgba(0,0,0,0)",
+    "title": {"text": "Correlation of Reported Cases & Population"},
+    "template": TEMPLATE,
+}
+
+SUNBURST_LAYOUT = {
+    "coloraxis": {"colorbar": {"title": {"text": "death"}},
+                  "colorscale": [[i / (len(px.colors.diverging.RdBu) - 1), color] for i, color in enumerate(px.colors.diverging.RdBu)]},
+    "height": 600,
+    "legend": {"tracegroupgap": 0},
+    "margin": {"b": 70, "l": 1, "r": 1, "t": 100},
+    "title": {"text": "Positive Cases by Region - Click To Expand"},
+    "template": TEMPLATE,
+}
+
+BAR_LAYOUT = {
+    "xaxis": {"anchor": "y", "domain": [0.0, 1.0]},
+    "yaxis": {"anchor": "x", "domain": [0.0, 1.0], "title": {"text": "States"}, "categoryorder": "array"},
+    "legend": {"title": {"text": "state"}, "tracegroupgap": 0, "x": 0.01, "y": 1.0,
+               "bgcolor": "rgba(255, 255, 255, 0)", "bordercolor": "rgba(255, 255, 255, 0)"},
+    "margin": {"t": 60},
+    "barmode": "relative",
+    "plot_bgcolor": "rgba(0,0,0,0)",
+    "title": {"text": "Reported Cases"},
+    "showlegend": False,
+    "template": TEMPLATE,
+}
+
+
+def choropleth_map(df) -> dict:
+    """ Create the map of positive cases by state. """
+    return {"data": [{"type": "choropleth",
+                      "locations": df["state"].values,
+                      "z": df["positive"].astype(int).values,
+                      "autocolorscale": True,
+                      "colorscale": [[0.0, "rgb(0,0,255)"], [1.0, "rgb(255,0,0)"]],
+                      "colorbar": {"title": {"text": "Positive"}},
+                      "locationmode": "USA-states"}],
+            "layout": MAP_LAYOUT}
+
+
+def states_pie(df) -> dict:
+    """ Create the pie of positive cases by state. """
+    return {"data": [{"type": "pie",
+                      "labels": df["state"].values,
+                      "values": df["positive"].values,
+                      "domain": {"x": [0, 0.9], "y": [0.0, 1.0]},
+                      "hovertemplate": "state=%{label}<br>positive=%{value}<extra></extra>",
+                      "legendgroup": "",
+                      "name": "",
+                      "showlegend": True,
+                      "textposition": "inside"}] if len(df) else [],  # plotly.express adds no trace for no rows
+            "layout": PIE_LAYOUT}
+
+
+def corel_scatter(df) -> dict:
+    """ Create the scatter of positive cases by population. """
+    return {"data": [{"type": "scatter",
+                      "x": df["pop"].fillna(0).values,
+                      "y": df["positive"].fillna(0).values,
+                      "mode": "markers",
+                      "text": df["state name"].values}],
+            "layout": SCATTER_LAYOUT}
+
+
+def regions_sunburst(tree: dict) -> dict:
+    """ Create the sunburst of positive cases by region, division and state, colored by deaths, from the nodes of sunburst.for_date. """
+    return {"data": [{"type": "sunburst",
+                      "ids": tree["ids"],
+                      "labels": tree["labels"],
+                      "parents": tree["parents"],
+                      "values": tree["values"],
+                      "branchvalues": "total",
+                      "customdata": tree["colors"][:, None],
+                      "marker": {"coloraxis": "coloraxis", "colors": tree["colors"]},
+                      "domain": {"x": [0.0, 1.0], "y": [0.0, 1.0]},
+                      "hovertemplate": "labels=%{label}<br>positive=%{value}<br>parent=%{parent}<br>id=%{id}<br>death=%{color}<extra></extra>",
+                      "name": ""}] if len(tree["ids"]) else [],
+            "layout": SUNBURST_LAYOUT}
+
+
+def states_bar(df, column: str, label: str) -> dict:
+    """ Create the horizontal barchart of the column by state, one colored bar per row. """
+    colors = TEMPLATE["layout"]["colorway"]
+    states = df["state"].astype(str).tolist()
+    data = [{"type": "bar",
+             "orientation": "h",
+             "x": [x],
+             "y": [state],
+             "name": state,
+             "legendgroup": state,
+             "offsetgroup": state,
+             "alignmentgroup": "True",
+             "marker": {"color": colors[i % len(colors)]},
+             "hovertemplate": f"state=%{{y}}<br>{column}=%{{x}}<extra></extra>",
+             "showlegend": True,
+             "textposition": "auto",
+             "xaxis": "x",
+             "yaxis": "y"} for i, (state, x) in enumerate(zip(states, df[column].values))]
+    layout = dict(BAR_LAYOUT,
+                  xaxis=dict(BAR_LAYOUT["xaxis"], title={"text": f"{label} Cases"}),
+                  yaxis=dict(BAR_LAYOUT["yaxis"], categoryarray=states[::-1]))
+    return {"data": data, "layout": layout}
+
+
+# the figure JSON is compacted (see compact) unless COVID_COMPACT_FIGURES=0
+COMPACT_FIGURES = os.environ.get("COVID_COMPACT_FIGURES", "1") not in ("", "0")
+
+# significant digits kept of the numbers that are not integers
+FLOAT_DIGITS = int(os.environ.get("COVID_FLOAT_DIGITS", 6))
+
+_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_DAY_MS = 24 * 60 * 60 * 1000
+
+
+def _compact_numbers(values):
+    """ Return the numbers as list, integers without '.0', the other floats rounded to FLOAT_DIGITS significant digits, NaN as None.
+    Return None if it is not an array of numbers. """
+    values = np.asarray(values)
+    if values.dtype.kind in "iu":
+        return values.tolist()
+    if values.dtype.kind != "f" or values.size == 0:
+        return None
+    missing = np.isnan(values)
+    finite = np.where(missing, 0, values).astype("float64")
+    if np.array_equal(finite, np.round(finite)):
+        result = np.array(finite.astype("int64").tolist(), dtype=object)
+    else:
+        with np.errstate(divide="ignore"):
+            scale = 10.0 ** (FLOAT_DIGITS - 1 - np.floor(np.log10(np.abs(np.where(finite == 0, 1, finite)))))
+        result = np.array((np.round(finite * scale) / scale).tolist(), dtype=object)
+    result[missing] = None
+    return result.tolist()
+
+
+def _daily_dates(values):
+    """ Return (x0, dx in ms) if the values are days ('YYYY-MM-DD' or datetimes at midnight) evenly spaced, else None. """
+    if len(values) < 3:
+        return None
+    if all(isinstance(v, str) and _DATE.match(v) for v in values):
+        days = np.array(values, dtype="datetime64[D]")
+    elif all(isinstance(v, (datetime.date, np.datetime64)) for v in values):
+        times = np.array(values, dtype="datetime64[ns]")
+        days = times.astype("datetime64[D]")
+        if (days != times).any():
+            return None
+    else:
+        return None
+    steps = np.diff(days).astype("int64")
+    if steps[0] == 0 or not (steps == steps[0]).all():
+        return None
+    return str(days[0]), int(steps[0]) * _DAY_MS
+
+
+def _compact_trace(trace: dict, layout: dict) -> dict:
+    trace = dict(trace)
+    for key, value in trace.items():
+        if isinstance(value, (np.ndarray, list, tuple)) and not isinstance(value, str):
+            numbers = _compact_numbers(value) if not any(isinstance(v, (str, bool, type(None))) for v in value) else None
+            if numbers is not None:
+                trace[key] = numbers
+    # daily x of lines and bars is sent as the first day and the step, the axis is then marked as date (plotly cannot guess it)
+    x = trace.get("x")
+    if trace.get("type", "scatter") in ("scatter", "bar") and isinstance(x, (np.ndarray, list)):
+        dates = _daily_dates(list(x))
+        if dates is not None:
+            del trace["x"]
+            trace["x0"], trace["dx"] = dates
+            axis = "xaxis" + trace.get("xaxis", "x")[1:]
+            layout[axis] = dict(layout.get(axis, {}), type="date")
+    return trace
+
+
+def compact(figure):
+    """ Shrink the figure (dict, or tuple/list of them) for JSON: integer counts without '.0', the other floats trimmed
+    to FLOAT_DIGITS significant digits, evenly spaced daily x as x0/dx. The figure itself is not changed. """
+    if isinstance(figure, (tuple, list)):
+        return type(figure)(compact(f) for f in figure)
+    if not COMPACT_FIGURES or not isinstance(figure, dict) or "data" not in figure:
+        return figure
+    layout = dict(figure.get("layout", {}))
+    result = dict(figure, data=[_compact_trace(trace, layout) for trace in figure["data"]], layout=layout)
+    if figure.get("frames"):
+        result["frames"] = [dict(frame, data=[_compact_trace(trace, {}) for trace in frame.get("data", [])]) for frame in figure["frames"]]
+    return result
+
+
+def compacted(func):
+    """ Decorator compacting the figures the function returns (plotly figures are turned to dicts). """
+    @functools.wraps(func)
+    def wrapper(*args):
+        result = func(*args)
+        with telemetry.stage("compact"):
+            if isinstance(result, (tuple, list)):
+                return compact(type(result)(f.to_dict() if hasattr(f, "to_dict") else f for f in result))
+            return compact(result.to_dict() if hasattr(result, "to_dict") else result)
+    return wrapper
+
+
+def _as_json(figure):
+    return json.loads(json.dumps(figure, cls=plotly.utils.PlotlyJSONEncoder))
+
+
+def differences(expected, actual, path: str = "") -> list:
+    """ Compare two figures (or their parts) as JSON, numbers with relative tolerance 1e-6, return paths where they differ. """
+    if path == "":
+        expected, actual = _as_json(expected), _as_json(actual)
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        return [diff for key in sorted(set(expected) | set(actual))
+                for diff in differences(expected.get(key), actual.get(key), f"{path}.{key}")]
+    if isinstance(expected, list) and isinstance(actual, list):
+        if len(expected) != len(actual):
+            return [f"{path} (length {len(expected)} != {len(actual)})"]
+        return [diff for i, (e, a) in enumerate(zip(expected, actual)) for diff in differences(e, a, f"{path}[{i}]")]
+    numbers = (int, float)
+    if isinstance(expected, numbers) and isinstance(actual, numbers) and not isinstance(expected, bool):
+        return [] if np.isclose(expected, actual, rtol=1e-6, atol=0) else [f"{path} ({expected} != {actual})"]
+    return [] if expected == actual else [f"{path} ({expected!r} != {actual!r})"]
+
+
+if __name__ == "__main__":
+    # parity check: the fast builders against the plotly built charts of the app
+    import app
+
+    checks = {}
+    for date in sys.argv[1:] or [str(app.latest_date()), "2020-06-01", "2020-03-15"]:
+        for name, expected, actual in zip(["map", "pie", "scatter", "sunburst"], app.build_date_figures(date), app.fast_date_figures(date)):
+            checks[f"{date} {name}"] = differences(expected, actual)
+    for states in [[], ["NY", "CA", "TX"]]:
+        for dropval in app.BAR_CHART_LABELS:
+            checks[f"bar {states} {dropval}"] = differences(app.build_bar_chart(states, dropval), app.fast_bar_chart(states, dropval))
+
+    for check, diffs in checks.items():
+        print(f"{check:40} {'ok' if not diffs else 'DIFFERS'}")
+        for diff in diffs[:10]:
+            print("   ", diff)
+    sys.exit(1 if any(checks.values()) else 0)
@@ -0,0 +1,57 @@
+# module with static data about USA geography - how the states group into divisions and regions
+
+import pandas as pd
+
+# USA divisions
+divisions = [{"New England": ['Connecticut', 'Maine', 'Massachusetts', 'New Hampshire', 'Rhode Island', 'Vermont']},
+    {"Mid-Atlantic": ['New Jersey', 'New York', 'Pennsylvania']},
+    {"East North Central": ['Illinois', 'Indiana', 'Michigan', 'Ohio', 'Wisconsin']},
+    {"West North Central": ["Iowa", "Kansas", "Minnesota", "Missouri", "Nebraska", "North Dakota", "South Dakota"]},
+    {'South Atlantic': ('Delaware', 'Florida', 'Georgia', 'Maryland', 'North Carolina', 'South Carolina', 'Virginia', 'District of Columbia', 'West Virginia')},
+    {'East South Central': ('Alabama', 'Kentucky', 'Mississippi', 'Tennessee')},
+    {'West South Central': ('Arkansas', 'Louisiana', 'Oklahoma', 'Texas')},
+    {'Mountain': ('Arizona', 'Colorado', 'Idaho', 'Montana', 'Nevada', 'New Mexico', 'Utah', 'Wyoming')},
+    {'Pacific': ('Alaska', 'California', 'Hawaii', 'Oregon', 'Washington')}]
+
+# USA regions
+regions = [
+    {"Northeast":
+        [
+            {"New England": ['Connecticut', 'Maine', 'Massachusetts', 'New Hampshire', 'Rhode Island', 'Vermont']},
+            {"Mid-Atlantic": ['New Jersey', 'New York', 'Pennsylvania']}
+        ]
+     },
+
+    {"Midwest":
+        [
+            {"East North Central": ['Illinois', 'Indiana', 'Michigan', 'Ohio', 'Wisconsin']},
+            {"West North Central": ["Iowa", "Kansas", "Minnesota", "Missouri", "Nebraska", "North Dakota", "South Dakota"]},
+        ]
+     },
+
+    {"South":
+        [
+            {'South Atlantic': ('Delaware', 'Florida', 'Georgia', 'Maryland', 'North Carolina', 'South Carolina', 'Virginia', 'District of Columbia','West Virginia')},
+            {'East South Central': ('Alabama', 'Kentucky', 'Mississippi', 'Tennessee')},
+            {'West South Central': ('Arkansas', 'Louisiana', 'Oklahoma', 'Texas')},
+        ]
+     },
+
+    {"West":
+        [
+            {'Mountain': ('Arizona', 'Colorado', 'Idaho', 'Montana', 'Nevada', 'New Mexico', 'Utah', 'Wyoming')},
+            {'Pacific': ('Alaska', 'California', 'Hawaii', 'Oregon', 'Washington')}
+        ]
+    },
+]
+
+
+def state_regions() -> pd.DataFrame:
+    """ Create lookup table with one row per state: state name, division, region. """
+    rows = [(state, division_name, region_name)
+            for region in regions
+            for region_name, region_list in region.items()
+            for division in region_list
+            for division_name, states in division.items()
+            for state in states]
+    return pd.DataFrame(rows, columns=["state name", "division", "region"])
@@ -0,0 +1,19 @@
+# gunicorn settings - the app is imported once in the master (the data loaded, indexed and the figures rendered)
+# and the workers are forked from it, sharing its memory copy-on-write, so more workers cost little extra memory
+#
+# the port and the number of workers come from PORT and WEB_CONCURRENCY (gunicorn reads them by itself)
+
+preload_app = True
+
+
+def when_ready(server):
+    """ Warm the preloaded app up in the master, before the workers are forked. """
+    if server.cfg.preload_app:
+        import app
+        app.warmup()
+
+
+def post_fork(server, worker):
+    """ Start the data refresh thread in the worker (threads of the master do not survive the fork). """
+    import datastore
+    datastore.start_refresher()
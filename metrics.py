@@ -0,0 +1,101 @@
+# module with the derived metrics of the states - one state x date matrix per metric, computed in one pass when the data is loaded
+#
+# the feeds hold cumulative counts, days a state did not report are carried forward from the day before
+
+import numpy as np
+import pandas as pd
+
+import datastore
+
+# the derived metrics, all of them are float matrices (states x dates), NaN where not known
+METRICS = ["cases_per_million", "deaths_per_million", "mortality", "positivity", "cases_7d", "deaths_7d"]
+
+# days in the rolling averages
+WINDOW = 7
+
+
+def _ffill(values: np.ndarray) -> np.ndarray:
+    """ Carry the last known value forward along the dates (axis 1). """
+    index = np.where(np.isnan(values), 0, np.arange(values.shape[1]))
+    np.maximum.accumulate(index, axis=1, out=index)
+    return values[np.arange(values.shape[0])[:, None], index]
+
+
+def _rolling_increase(values: np.ndarray, window: int) -> np.ndarray:
+    """ Average daily increase over the last window days, from cumulative values. """
+    rolling = np.full(values.shape, np.nan)
+    rolling[:, window:] = (values[:, window:] - values[:, :-window]) / window
+    return rolling
+
+
+def compute(daily_states_df: pd.DataFrame, pop_df: pd.DataFrame) -> dict:
+    """ Compute all the metrics, return dict with 'states', 'dates' (int) and a states x dates matrix for each metric
+    and for the cumulative 'positive' and 'death' counts, all of them read-only. """
+    states = np.sort(daily_states_df["state"].astype(str).unique())
+    dates = np.sort(daily_states_df["date"].unique())
+    rows = np.searchsorted(states, daily_states_df["state"].astype(str).values)
+    cols = np.searchsorted(dates, daily_states_df["date"].values)
+
+    counts = {}
+    for col in ["positive", "death", "totalTestResults"]:
+        values = np.full((len(states), len(dates)), np.nan)
+        values[rows, cols] = daily_states_df[col].values
+        counts[col] = _ffill(values)
+    positive, death, tests = counts["positive"], counts["death"], counts["totalTestResults"]
+
+    # territories without population get NaN
+    pop = pop_df.set_index("state")["pop"].reindex(states).values.astype("float64")[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        matrix = {
+            "cases_per_million": positive / pop * 1_000_000,
+            "deaths_per_million": death / pop * 1_000_000,
+            "mortality": np.where(positive > 0, death / positive * 100, np.nan),
+            "positivity": np.where(tests > 0, positive / tests * 100, np.nan),
+            "cases_7d": _rolling_increase(positive, WINDOW),
+            "deaths_7d": _rolling_increase(death, WINDOW),
+        }
+    result = dict(matrix, states=states, dates=dates, positive=positive, death=death)
+    for values in result.values():
+        values.flags.writeable = False
+    return result
+
+
+# the metrics of the data held by the data store, computed again when it refreshes
+matrix = compute(datastore.daily_states_df, datastore.pop_df)
+
+
+@datastore.on_refresh
+def _recompute():
+    global matrix
+    matrix = compute(datastore.daily_states_df, datastore.pop_df)
+
+
+def for_date(metric: str, date: int) -> pd.Series:
+    """ Return the metric of all the states for one date (as int, e.g. 20210307), indexed by state. """
+    m = matrix
+    col = np.searchsorted(m["dates"], date)
+    if col == len(m["dates"]) or m["dates"][col] != date:
+        return pd.Series(np.nan, index=m["states"], name=metric)
+    return pd.Series(m[metric][:, col], index=m["states"], name=metric)
+
+
+def latest(metric: str) -> pd.Series:
+    """ Return the latest value of the metric for all the states, indexed by state. """
+    m = matrix
+    return pd.Series(m[metric][:, -1], index=m["states"], name=metric)
+
+
+def for_range(metric: str, start: int, end: int):
+    """ Return states, dates between start and end (included, as int) and the states x dates matrix of the metric for them. """
+    m = matrix
+    cols = slice(np.searchsorted(m["dates"], start), np.searchsorted(m["dates"], end, side="right"))
+    return m["states"], m["dates"][cols], m[metric][:, cols]
+
+
+def for_state(metric: str, state: str) -> pd.Series:
+    """ Return the metric of one state for all the dates, indexed by date. """
+    m = matrix
+    row = np.searchsorted(m["states"], state)
+    if row == len(m["states"]) or m["states"][row] != state:
+        return pd.Series(np.nan, index=m["dates"], name=metric)
+    return pd.Series(m[metric][row], index=m["dates"], name=metric)
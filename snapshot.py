@@ -0,0 +1,146 @@
+# module for the local on-disk snapshot of the API feeds
+#
+# every feed is stored as a directory with one typed .npy file per column plus meta.json,
+# the columns are memory-mapped on load, so the app can start without touching the network
+
+import os, json, time, shutil, contextlib
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows, a single process there
+    fcntl = None
+
+
+SNAPSHOT_DIR = os.environ.get("COVID_SNAPSHOT_DIR", os.path.join(os.path.dirname(__file__), "data", "snapshot"))
+
+# how old (in seconds) a snapshot can be to be used instead of the API, the API is frozen since 03/2021
+MAX_AGE = int(os.environ.get("COVID_SNAPSHOT_MAX_AGE", 24 * 60 * 60))
+
+# when set, never go to the network if there is any snapshot at all
+OFFLINE = os.environ.get("COVID_OFFLINE", "") not in ("", "0")
+
+
+def snapshot_name(source: str) -> str:
+    """ Turn the API url into snapshot name, e.g. '.../v1/states/daily.json' -> 'states_daily'. """
+    path = source.split("/v1/")[-1]
+    return path.replace(".json", "").replace("/", "_")
+
+
+def _path(name: str) -> str:
+    return os.path.join(SNAPSHOT_DIR, name)
+
+
+@contextlib.contextmanager
+def _locked(name: str, shared: bool = False):
+    """ Hold the lock of the snapshot, exclusive while it is swapped, shared while it is loaded
+    (the workers of the app save the same feeds at once). """
+    try:
+        f = open(f"{_path(name)}.lock", "a")
+    except OSError:
+        # read-only snapshot directory (e.g. the fixture), nobody saves into it
+        if not shared:
+            raise
+        yield
+        return
+    with f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
+
+
+def read_meta(name: str) -> dict:
+    """ Return the snapshot metadata, or None if there is no (complete) snapshot. """
+    try:
+        with open(os.path.join(_path(name), "meta.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_fresh(name: str, max_age: int = None) -> bool:
+    """ Check if the snapshot exists and is not older than max_age seconds. """
+    meta = read_meta(name)
+    if meta is None:
+        return False
+    if OFFLINE:
+        return True
+    max_age = MAX_AGE if max_age is None else max_age
+    return time.time() - meta["fetched"] <= max_age
+
+
+def save(name: str, df: pd.DataFrame, source: str = "", **extra) -> None:
+    """ Write the dataframe as typed columns, the old snapshot is swapped only when the new one is complete
+    (the last of the processes saving it at once wins). """
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    tmp = f"{_path(name)}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    columns = []
+    for i, col in enumerate(df.columns):
+        s = df[col]
+        file = f"{i}.npy"
+        if pd.api.types.is_datetime64_any_dtype(s):
+            kind = "datetime"
+            np.save(os.path.join(tmp, file), s.values.view("int64"))
+        elif s.dtype.kind in "biuf":
+            kind = "numeric"
+            np.save(os.path.join(tmp, file), s.values)
+        else:
+            # strings (or empty columns) - fixed width unicode can be memory-mapped, None is kept in a mask
+            kind = "category" if isinstance(s.dtype, pd.CategoricalDtype) else "str"
+            mask = s.isna().values
+            np.save(os.path.join(tmp, file), np.where(mask, "", s.astype(str).values).astype(str))
+            np.save(os.path.join(tmp, f"{i}.mask.npy"), mask)
+        columns.append({"name": col, "file": file, "kind": kind, "dtype": str(s.dtype)})
+
+    meta = dict(extra, source=source, fetched=time.time(), rows=len(df), columns=columns)
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    old = f"{_path(name)}.old-{os.getpid()}"
+    with _locked(name):
+        if os.path.exists(_path(name)):
+            os.rename(_path(name), old)
+        os.rename(tmp, _path(name))
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def touch(name: str) -> None:
+    """ Mark the snapshot as fetched now (the API has nothing newer), keep the rest of its metadata. """
+    with _locked(name):
+        meta = read_meta(name)
+        meta["fetched"] = time.time()
+        tmp = os.path.join(_path(name), f"meta.json.tmp-{os.getpid()}")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(_path(name), "meta.json"))
+
+
+def load(name: str) -> pd.DataFrame:
+    """ Load the snapshot, numeric columns are memory-mapped straight from the disk. """
+    with _locked(name, shared=True):
+        return _load(name)
+
+
+def _load(name: str) -> pd.DataFrame:
+    meta = read_meta(name)
+    path = _path(name)
+    data = {}
+    for c in meta["columns"]:
+        values = np.load(os.path.join(path, c["file"]), mmap_mode="r")
+        if c["kind"] == "datetime":
+            data[c["name"]] = pd.Series(values.view(c["dtype"]))
+        elif c["kind"] == "numeric":
+            data[c["name"]] = pd.Series(values)
+        else:
+            mask = np.load(os.path.join(path, c["file"].replace(".npy", ".mask.npy")))
+            s = pd.Series(values.astype(object))
+            s[mask] = None
+            data[c["name"]] = s.astype("category") if c["kind"] == "category" else s
+    if not data:
+        return pd.DataFrame()
+    # concat keeps the columns as they are, a dataframe of them would copy the mapped ones of the same dtype into one block
+    return pd.concat(list(data.values()), axis=1, keys=list(data), copy=False)
@@ -0,0 +1,85 @@
+# module for the static charts of the layout - rendered once into JSON files keyed by data version and render version
+#
+# build them ahead (e.g. at deploy) with:  python static_figures.py
+
+import os, json, shutil, hashlib
+
+import plotly
+
+import datastore
+import figures
+from charts import hosp_death_daily_increase, create_mortality_barchart, cumulative_linechart_us, total_tests_pie, hospitalized, cumulative_barchart_us, scatter_bar_population_positive
+
+FIGURES_DIR = os.environ.get("COVID_FIGURES_DIR", os.path.join(os.path.dirname(__file__), "data", "figures"))
+
+# charts of the layout that depend only on the data
+STATIC_FIGURES = {
+    "cumulative_linechart_us": cumulative_linechart_us,
+    "cumulative_barchart_us": cumulative_barchart_us,
+    "total_tests_pie": total_tests_pie,
+    "hosp_death_daily_increase": hosp_death_daily_increase,
+    "hospitalized": hospitalized,
+    "scatter_bar_population_positive": scatter_bar_population_positive,
+    "create_mortality_barchart": create_mortality_barchart,
+}
+
+
+# code the charts are rendered by (the schema and compaction of the data, the derived metrics, the chart builders),
+# a deploy changing it (or plotly, or the figure compaction) must not serve the old files - nor the cached callback outputs,
+# keyed by it too (see app.cached_version)
+RENDER_SOURCES = ("datastore.py", "metrics.py", "sunburst.py", "utils.py", "table_query.py",
+                  "charts.py", "figures.py", "static_figures.py")
+
+
+def render_version() -> str:
+    """ Identify how the charts are rendered: hash of their code, plotly version and the figure compaction settings. """
+    digest = hashlib.sha1(f"{plotly.__version__}-{figures.COMPACT_FIGURES}-{figures.FLOAT_DIGITS}".encode())
+    for file in RENDER_SOURCES:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), file), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+RENDER_VERSION = render_version()
+
+
+def figure_path(name: str, version: str = None) -> str:
+    """ Return path of the JSON file for chart name and data version (the current one by default), rendered the current way. """
+    version = version or datastore.data_version()
+    return os.path.join(FIGURES_DIR, f"{version}-{RENDER_VERSION}", f"{name}.json")
+
+
+def render(name: str) -> str:
+    """ Render the chart and save it as JSON, return the JSON. """
+    figure = json.dumps(figures.compact(STATIC_FIGURES[name]().to_dict()), cls=plotly.utils.PlotlyJSONEncoder)
+    path = figure_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "w") as f:
+        f.write(figure)
+    os.replace(tmp, path)
+    return figure
+
+
+def load(name: str) -> dict:
+    """ Load the chart for the current data as figure dict, render it only if it was not built yet. """
+    try:
+        with open(figure_path(name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return json.loads(render(name))
+
+
+def build() -> None:
+    """ Render all the static charts for the current data, remove those of the other data and render versions. """
+    for name in STATIC_FIGURES:
+        render(name)
+        print(figure_path(name))
+    current = os.path.dirname(figure_path(next(iter(STATIC_FIGURES))))
+    for entry in os.scandir(FIGURES_DIR):
+        if entry.is_dir() and entry.path != current:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    build()
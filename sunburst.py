@@ -0,0 +1,113 @@
+# module with the sunburst cube - positive cases and deaths of all the hierarchy nodes (USA, regions, divisions, states)
+# for all the dates, aggregated in one pass when the data is loaded, the chart for a date is then just a slice of it
+#
+# the nodes follow px.sunburst(path=["total positive", "region", "division", "state"]) of the daily state numbers:
+# values are sums of positive cases, colors are deaths averaged with positive cases as weights, zeros count as missing
+
+import numpy as np
+import pandas as pd
+
+import datastore
+
+
+def compute(daily_states_df: pd.DataFrame, pop_df: pd.DataFrame) -> dict:
+    """ Compute the cube, return dict with the 'dates' (int), the nodes ('labels', 'suffixes' of their ids below the root,
+    'parent_suffixes', leaves first, in px order) and nodes x dates matrices of 'values', 'colors' and 'present' (has a reporting state),
+    all of them read-only. """
+    dates = np.sort(daily_states_df["date"].unique())
+    cols = np.searchsorted(dates, daily_states_df["date"].values)
+    positive = daily_states_df["positive"].values.astype("float64")
+
+    # root label is the total of the date (all the states, also those without population data)
+    totals = np.bincount(cols, weights=np.nan_to_num(positive), minlength=len(dates))
+
+    # leaves are the states with region/division, sorted like groupby does
+    states = pop_df.sort_values("state")
+    leaf_index = pd.Series(np.arange(len(states)), index=states["state"].values)
+    rows = leaf_index.reindex(daily_states_df["state"].astype(str).values).values
+    known = ~np.isnan(rows)
+    rows, leaf_cols = rows[known].astype(int), cols[known]
+
+    present = np.zeros((len(states), len(dates)), dtype=bool)
+    present[rows, leaf_cols] = True
+    value = np.zeros((len(states), len(dates)))
+    death = np.zeros((len(states), len(dates)))
+    value[rows, leaf_cols] = positive[known]
+    death[rows, leaf_cols] = daily_states_df["death"].values.astype("float64")[known]
+    value[value == 0] = np.nan
+    death[death == 0] = np.nan
+    # the sums skip missing values, the weighted averages do not - but the states not reporting are left out of both
+    sums = np.where(present, np.nan_to_num(value), 0)
+    weights = np.where(present, value, 0)
+    weighted = np.where(present, death * value, 0)
+
+    labels, suffixes, parent_suffixes = [], [], []
+    node_sums, node_weights, node_weighted, node_present = [], [], [], []
+
+    def add_nodes(keys: list, label_of, suffix_of, parent_of):
+        for key in sorted(set(keys)):
+            members = np.array([k == key for k in keys])
+            labels.append(label_of(key))
+            suffixes.append(suffix_of(key))
+            parent_suffixes.append(parent_of(key))
+            node_sums.append(sums[members].sum(axis=0))
+            node_weights.append(weights[members].sum(axis=0))
+            node_weighted.append(weighted[members].sum(axis=0))
+            node_present.append(present[members].any(axis=0))
+
+    region, division, state = states["region"].tolist(), states["division"].tolist(), states["state"].tolist()
+    add_nodes(list(zip(state, division, region)), lambda k: k[0], lambda k: f"/{k[2]}/{k[1]}/{k[0]}", lambda k: f"/{k[2]}/{k[1]}")
+    add_nodes(list(zip(division, region)), lambda k: k[0], lambda k: f"/{k[1]}/{k[0]}", lambda k: f"/{k[1]}")
+    add_nodes(region, lambda k: k, lambda k: f"/{k}", lambda k: "")
+    add_nodes([""] * len(state), lambda k: None, lambda k: "", lambda k: None)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        colors = np.array(node_weighted) / np.array(node_weights)
+    result = {"dates": dates, "totals": totals, "labels": np.array(labels, dtype=object),
+              "suffixes": np.array(suffixes, dtype=object), "parent_suffixes": np.array(parent_suffixes, dtype=object),
+              "values": np.array(node_sums), "colors": colors, "present": np.array(node_present)}
+    for values in result.values():
+        values.flags.writeable = False
+    return result
+
+
+# the cube of the data held by the data store, computed again when it refreshes
+cube = compute(datastore.daily_states_df, datastore.pop_df)
+
+
+@datastore.on_refresh
+def _recompute():
+    global cube
+    cube = compute(datastore.daily_states_df, datastore.pop_df)
+
+
+def for_date(date: int) -> dict:
+    """ Return the sunburst nodes for the date (as int, e.g. 20210307): 'ids', 'labels', 'parents', 'values' and 'colors' arrays. """
+    c = cube
+    col = np.searchsorted(c["dates"], date)
+    if col == len(c["dates"]) or c["dates"][col] != date:
+        return {key: np.array([]) for key in ["ids", "labels", "parents", "values", "colors"]}
+    mask = c["present"][:, col]
+    root = str(int(c["totals"][col]))
+    labels = c["labels"][mask]
+    return {"ids": np.array([root + suffix for suffix in c["suffixes"][mask]]),
+            "labels": np.array([root if label is None else label for label in labels]),
+            "parents": np.array(["" if parent is None else root + parent for parent in c["parent_suffixes"][mask]]),
+            "values": c["values"][mask, col],
+            "colors": c["colors"][mask, col]}
+
+
+def for_range(start: int, end: int) -> dict:
+    """ Return the sunburst nodes reporting on any date between start and end (included, as int): the 'dates', 'ids', 'labels'
+    and 'parents' the same for all the dates (the root is 'USA'), nodes x dates matrices of 'values' (zero where the node
+    has no reporting state) and 'colors'. """
+    c = cube
+    cols = slice(np.searchsorted(c["dates"], start), np.searchsorted(c["dates"], end, side="right"))
+    mask = c["present"][:, cols].any(axis=1)
+    present = c["present"][mask, cols]
+    return {"dates": c["dates"][cols],
+            "ids": np.array(["USA" + suffix for suffix in c["suffixes"][mask]]),
+            "labels": np.array(["USA" if label is None else label for label in c["labels"][mask]]),
+            "parents": np.array(["" if parent is None else "USA" + parent for parent in c["parent_suffixes"][mask]]),
+            "values": np.where(present, c["values"][mask, cols], 0),
+            "colors": np.where(present, c["colors"][mask, cols], np.nan)}
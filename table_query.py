@@ -0,0 +1,84 @@
+# module for the server side filtering, sorting and paging of the DataTable (page_action/filter_action/sort_action="custom")
+
+import math
+import operator
+import pandas as pd
+
+# DataTable filter operators (both the symbol and the word form) -> vectorized comparison
+COMPARISONS = {
+    "ge": operator.ge, ">=": operator.ge,
+    "le": operator.le, "<=": operator.le,
+    "lt": operator.lt, "<": operator.lt,
+    "gt": operator.gt, ">": operator.gt,
+    "ne": operator.ne, "!=": operator.ne,
+    "eq": operator.eq, "=": operator.eq,
+}
+
+# longer operators first, so that '>=' is not taken for '>'
+OPERATORS = [">=", "<=", "!=", "ge ", "le ", "lt ", "gt ", "ne ", "eq ", "contains ", "datestartswith ", "<", ">", "="]
+
+
+def split_filter_part(filter_part: str):
+    """ Split one part of filter query like '{positive} > 1000' into (column, operator, value), or (None, None, None). """
+    for op in OPERATORS:
+        if op in filter_part:
+            name_part, value_part = filter_part.split(op, 1)
+            name = name_part[name_part.find("{") + 1: name_part.rfind("}")]
+            value_part = value_part.strip()
+            if not value_part:
+                return None, None, None
+            quote = value_part[0]
+            if quote == value_part[-1] and quote in ("'", '"', "`") and len(value_part) > 1:
+                value = value_part[1:-1].replace("\\" + quote, quote)
+            else:
+                try:
+                    value = float(value_part)
+                except ValueError:
+                    value = value_part
+            return name, op.strip(), value
+    return None, None, None
+
+
+def _as_text(value) -> str:
+    """ Turn the filter value back to text, numbers were parsed to float (1000 -> 1000.0). """
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def filter_mask(df: pd.DataFrame, filter_query: str) -> pd.Series:
+    """ Turn the DataTable filter query into one boolean mask over the whole dataframe. """
+    mask = pd.Series(True, index=df.index)
+    for filter_part in (filter_query or "").split(" && "):
+        name, op, value = split_filter_part(filter_part)
+        if name not in df.columns:
+            continue
+        column = df[name]
+        if op in COMPARISONS:
+            if column.dtype.kind not in "biuf":
+                # text compared as text, categories (e.g. the states) are unordered and compare only for equality
+                column, value = column.astype(str).where(column.notna()), _as_text(value)
+            elif isinstance(value, str):
+                # text compared with numbers matches nothing
+                mask &= False
+                continue
+            mask &= COMPARISONS[op](column, value).fillna(False)
+        elif op == "contains":
+            mask &= column.astype(str).str.contains(_as_text(value), regex=False)
+        elif op == "datestartswith":
+            mask &= column.astype(str).str.startswith(_as_text(value))
+    return mask
+
+
+def query_table(df: pd.DataFrame, filter_query: str, sort_by: list, page_current: int, page_size: int) -> dict:
+    """ Filter, sort and page the dataframe, return {'data': records of the page, 'page_count': number of pages}. """
+    df = df[filter_mask(df, filter_query)]
+    if sort_by:
+        df = df.sort_values([s["column_id"] for s in sort_by],
+                            ascending=[s["direction"] == "asc" for s in sort_by],
+                            kind="mergesort")
+    page_count = max(math.ceil(len(df) / page_size), 1)
+    # the page can be out of range after the filter changed
+    page_current = min(page_current or 0, page_count - 1)
+    page = df.iloc[page_current * page_size: (page_current + 1) * page_size]
+    return {"data": page.to_dict("records"), "page_count": page_count}
@@ -0,0 +1,162 @@
+# module with the hot path instrumentation - callback and stage timers, payload sizes and cache hit ratios of this process,
+# exposed in the Prometheus text format on /metrics, plus an optional per-request profiler
+#
+# stages of a callback (timed inside it): cache (lookup), data (slicing), figure (building), compact, serialize, deserialize
+
+import os, time, random, cProfile, threading, functools, contextlib
+
+import flask
+
+# upper bounds of the histogram buckets, seconds for the timers and bytes for the payloads
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTE_BUCKETS = (1_000, 10_000, 50_000, 100_000, 250_000, 500_000, 1_000_000, 2_500_000, 5_000_000, 10_000_000)
+
+# requests are profiled only if COVID_PROFILE_DIR is set: those with the X-Profile header, and COVID_PROFILE_SAMPLE of the others
+PROFILE_DIR = os.environ.get("COVID_PROFILE_DIR", "")
+PROFILE_SAMPLE = float(os.environ.get("COVID_PROFILE_SAMPLE", 0))
+
+_lock = threading.Lock()
+_current = threading.local()
+# (metric, labels) -> [count, sum, counts per bucket], labels are tuples of (name, value) pairs
+_histograms = {}
+_caches = {}
+
+HELP = {
+    "covid_callback_seconds": "Time spent in the callback.",
+    "covid_stage_seconds": "Time spent in a stage of the callback.",
+    "covid_payload_bytes": "Size of the callback responses before compression.",
+    "covid_cache_hits_total": "Cache lookups that found the value.",
+    "covid_cache_misses_total": "Cache lookups that did not find the value.",
+    "covid_cache_hit_ratio": "Share of the cache lookups that found the value.",
+}
+
+
+def _buckets(metric: str) -> tuple:
+    return BYTE_BUCKETS if metric.endswith("_bytes") else BUCKETS
+
+
+def observe(metric: str, value: float, **labels) -> None:
+    """ Add the value (seconds, or bytes if the metric ends with '_bytes') to the histogram of the metric with the labels. """
+    key = (metric, tuple(sorted(labels.items())))
+    buckets = _buckets(metric)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0, 0.0, [0] * len(buckets)]
+        histogram[0] += 1
+        histogram[1] += value
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                histogram[2][i] += 1
+
+
+def timed(name: str):
+    """ Decorator timing the callback, the stages timed while it runs (in this thread) are labeled with its name. """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            previous, _current.callback = getattr(_current, "callback", None), name
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe("covid_callback_seconds", time.perf_counter() - start, callback=name)
+                _current.callback = previous
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    """ Time a stage of the running callback, e.g.  with telemetry.stage("data"): ...  """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("covid_stage_seconds", time.perf_counter() - start,
+                callback=getattr(_current, "callback", None) or "none", stage=name)
+
+
+def register_cache(name: str, cache) -> None:
+    """ Report the hit/miss counters of the cache (anything with stats(), tiered ones per tier). """
+    _caches[name] = cache
+
+
+def _cache_samples():
+    for name, cache in _caches.items():
+        stats = cache.stats()
+        tiers = stats.items() if all(isinstance(v, dict) for v in stats.values()) else [("", stats)]
+        for tier, tier_stats in tiers:
+            labels = (("cache", name),) + ((("tier", tier),) if tier else ())
+            hits, misses = tier_stats.get("hits", 0), tier_stats.get("misses", 0)
+            yield "covid_cache_hits_total", "counter", labels, hits
+            yield "covid_cache_misses_total", "counter", labels, misses
+            if hits + misses:
+                yield "covid_cache_hit_ratio", "gauge", labels, hits / (hits + misses)
+
+
+def _labels(labels) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+def render() -> str:
+    """ Return all the metrics of this process in the Prometheus text format. """
+    lines, typed = [], set()
+
+    def declare(metric, kind):
+        if metric not in typed:
+            typed.add(metric)
+            lines.append(f"# HELP {metric} {HELP.get(metric, metric)}")
+            lines.append(f"# TYPE {metric} {kind}")
+
+    with _lock:
+        histograms = sorted((key, (n, total, list(buckets))) for key, (n, total, buckets) in _histograms.items())
+    for (metric, labels), (n, total, buckets) in histograms:
+        declare(metric, "histogram")
+        for bound, bucket in zip(_buckets(metric), buckets):
+            lines.append(f"{metric}_bucket{_labels(labels + (('le', bound),))} {bucket}")
+        lines.append(f"{metric}_bucket{_labels(labels + (('le', '+Inf'),))} {n}")
+        lines.append(f"{metric}_sum{_labels(labels)} {total}")
+        lines.append(f"{metric}_count{_labels(labels)} {n}")
+    for metric, kind, labels, value in _cache_samples():
+        declare(metric, kind)
+        lines.append(f"{metric}{_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _callback_name(app) -> str:
+    """ Return name of the callback the Dash request is for (or its output if it is not known). """
+    output = (flask.request.get_json(silent=True) or {}).get("output", "")
+    callback = app.callback_map.get(output, {}).get("callback")
+    return getattr(callback, "__name__", None) or output
+
+
+def install(app) -> None:
+    """ Add the /metrics route, payload sizes of the callback responses and the profiler to the server of the Dash app. """
+    server = app.server
+
+    @server.route("/metrics")
+    def metrics():
+        return flask.Response(render(), mimetype="text/plain; version=0.0.4")
+
+    @server.before_request
+    def start_profile():
+        if PROFILE_DIR and ("X-Profile" in flask.request.headers or random.random() < PROFILE_SAMPLE):
+            flask.g.profile = cProfile.Profile()
+            flask.g.profile.enable()
+
+    @server.after_request
+    def record_response(response):
+        profile = flask.g.pop("profile", None)
+        name = _callback_name(app) if flask.request.path.endswith("_dash-update-component") else None
+        if profile is not None:
+            profile.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            what = name or flask.request.path.strip("/").replace("/", "_") or "index"
+            profile.dump_stats(os.path.join(PROFILE_DIR, f"{time.time():.3f}-{os.getpid()}-{what}.prof"))
+        if name and response.status_code == 200 and not response.direct_passthrough:
+            observe("covid_payload_bytes", len(response.get_data()), callback=name)
+        return response
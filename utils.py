@@ -1,89 +1,51 @@
 # module collecting utility functions/data (will be used in app layout, or in charts)
 
-import requests, datetime, os
 import pandas as pd
 import numpy as np
 
+# the global API data and the state population are shared from the data store
+import datastore
 
-def get_api_data(source: str):
-    """ Get data from API source. """
-    data = requests.get(source)
-    return pd.read_json(data.text)
-
-
-# get the global API data
-daily_states_df = get_api_data("https://covidtracking.com/api/v1/states/daily.json")
-daily_us_df = get_api_data("https://covidtracking.com/api/v1/us/daily.json")
-current_state_df = get_api_data("https://covidtracking.com/api/v1/states/current.json")
-current_us_df = get_api_data("https://covidtracking.com/api/v1/us/current.json")
-
-# static data about state population
-pop_df = pd.read_json(os.path.join(os.path.dirname(__file__), "data", "us-pop.json"))
-
-# USA divisions
-divisions = [{"New England": ['Connecticut', 'Maine', 'Massachusetts', 'New Hampshire', 'Rhode Island', 'Vermont']},
-    {"Mid-Atlantic": ['New Jersey', 'New York', 'Pennsylvania']},
-    {"East North Central": ['Illinois', 'Indiana', 'Michigan', 'Ohio', 'Wisconsin']},
-    {"West North Central": ["Iowa, Kansas", "Minnesota", "Missouri", "Nebraska", "North Dakota", "South Dakota"]},
-    {'South Atlantic': ('Delaware', 'Florida', 'Georgia', 'Maryland', 'North Carolina', 'South Carolina', 'Virginia', 'District of Columbia', 'West Virginia')},
-    {'East South Central': ('Alabama', 'Kentucky', 'Mississippi', 'Tennessee')},
-    {'West South Central': ('Arkansas', 'Louisiana', 'Oklahoma', 'Texas')},
-    {'Mountain': ('Arizona', 'Colorado', 'Idaho', 'Montana', 'Nevada', 'New Mexico', 'Utah', 'Wyoming')},
-    {'Pacific': ('Alaska', 'California', 'Hawaii', 'Oregon', 'Washington')}]
-
-# USA regions
-regions = [
-    {"Northeast":
-        [
-            {"New England": ['Connecticut', 'Maine', 'Massachusetts', 'New Hampshire', 'Rhode Island', 'Vermont']},
-            {"Mid-Atlantic": ['New Jersey', 'New York', 'Pennsylvania']}
-        ]
-     },
-
-    {"Midwest":
-        [
-            {"East North Central": ['Illinois', 'Indiana', 'Michigan', 'Ohio', 'Wisconsin']},
-            {"West North Central": ["Iowa, Kansas", "Minnesota", "Missouri", "Nebraska", "North Dakota", "South Dakota"]},
-        ]
-     },
-
-    {"South":
-        [
-            {'South Atlantic': ('Delaware', 'Florida', 'Georgia', 'Maryland', 'North Carolina', 'South Carolina', 'Virginia', 'District of Columbia','West Virginia')},
-            {'East South Central': ('Alabama', 'Kentucky', 'Mississippi', 'Tennessee')},
-            {'West South Central': ('Arkansas', 'Louisiana', 'Oklahoma', 'Texas')},
-        ]
-     },
-
-    {"West":
-        [
-            {'Mountain': ('Arizona', 'Colorado', 'Idaho', 'Montana', 'Nevada', 'New Mexico', 'Utah', 'Wyoming')},
-            {'Pacific': ('Alaska', 'California', 'Hawaii', 'Oregon', 'Washington')}
-        ]
-    },
-]
+
+def index_by_date(df: pd.DataFrame):
+    """ Sort the dataframe by date and index it, return the sorted (read-only) dataframe and dict {date: slice of its rows}. """
+    df = datastore.read_only(df.sort_values("date", kind="mergesort").reset_index(drop=True))
+    dates = df["date"].values
+    starts = np.flatnonzero(np.r_[True, dates[1:] != dates[:-1]])
+    stops = np.r_[starts[1:], len(dates)]
+    return df, {int(dates[start]): slice(start, stop) for start, stop in zip(starts, stops)}
+
+
+# daily state data indexed by date, built on the first use and dropped when the data store refreshes
+_states_by_date = None
+
+
+@datastore.on_refresh
+def _drop_states_by_date():
+    global _states_by_date
+    _states_by_date = None
+
+
+def states_for_date(date: int) -> pd.DataFrame:
+    """ Return the rows of daily state data for one date (as int, e.g. 20210307) without scanning the whole history. """
+    global _states_by_date
+    if _states_by_date is None:
+        _states_by_date = index_by_date(datastore.daily_states_df)
+    df, index = _states_by_date
+    return df.iloc[index.get(date, slice(0, 0))]
 
 
 def create_df_for_date(date: str):
     """ Create dataframe for sunburts chart. It accepts date as a parsed string already, not as datetime.date object. """
     # slice the subdataframe and sum_up the numbers for particular date
-    date_df = daily_states_df[daily_states_df["date"] == date]
-    date_df["total positive"] = date_df["positive"].sum()
-    date_df["total hospitalized"] = date_df["hospitalized"].sum()
-    date_df["total recovered"] = date_df["recovered"].sum()
-    date_df["total death"] = date_df["death"].sum()
-    # merge it whole USA population
-    date_df = pd.merge(date_df, pop_df)
-    # add aditiononal cols and fill the cols with regions/divisions
-    date_df["region"] = "None"
-    date_df["division"] = "None"
-    for region in regions:
-        for region_name, region_list in region.items():
-            for division in region_list:
-                for division_name, states in division.items():
-                    for state in states:
-                        date_df.loc[(date_df["state name"] == state), "division"] = division_name
-                        date_df.loc[(date_df["state name"] == state), "region"] = region_name
+    date_df = states_for_date(int(date)).copy()
+    # summed as float64, float32 counts would round the total (it is the label of the sunburst root)
+    date_df["total positive"] = int(date_df["positive"].astype("float64").sum())
+    date_df["total hospitalized"] = int(date_df["hospitalized"].astype("float64").sum())
+    date_df["total recovered"] = int(date_df["recovered"].astype("float64").sum())
+    date_df["total death"] = int(date_df["death"].astype("float64").sum())
+    # merge it whole USA population (it already carries the regions/divisions)
+    date_df = pd.merge(date_df, datastore.pop_df)
 
     # fix the possible zero div error
     cols = ["totalTestResults", "positive", "negative", "hospitalized", "recovered", "death"]
@@ -91,9 +53,13 @@ def create_df_for_date(date: str):
     return date_df
 
 
-def rename_datatable_columns() -> list:
+# columns of the states in the DataTable
+TABLE_COLUMNS = ["state", "totalTestResults", "positive", "hospitalized", "recovered", "death"]
+
+
+def rename_datatable_columns(with_date: bool = False) -> list:
     """ Rename datatable column names, since I dont want to rename dataframe columns globally. """
-    df = current_state_df[["state", "totalTestResults", "positive", "hospitalized", "recovered", "death"]]
+    df = datastore.current_state_df[TABLE_COLUMNS]
     cols = [{"name": i, "id": i, "deletable": False, "selectable": False} for i in df.columns]
     cols[0]["name"] = "State"
     cols[1]["name"] = "Tested"
@@ -101,6 +67,9 @@ def rename_datatable_columns() -> list:
     cols[3]["name"] = "Hospitalized"
     cols[4]["name"] = "Recovered"
     cols[5]["name"] = "Fatal"
+    if with_date:
+        # the daily history table
+        cols.insert(1, {"name": "Date", "id": "date", "deletable": False, "selectable": False})
     return cols
 
 if __name__ == "__main__":